@@ -7,17 +7,20 @@ from pywikibot.exceptions import SiteDefinitionError
 
 import config.config
 from bots.common import run_vj_bot
-from utils.japanese_char import get_pronunciations
-from utils.japanese_utils import is_japanese_lyrics, is_fully_translated, convert_kana
+from utils.japanese_char import is_valid_reading, warm_up, pool_summaries
+from utils.japanese_utils import is_japanese_lyrics, is_fully_translated, convert_kana_lines
+from utils.line_alignment import align_lines, unaligned_regions
+from utils.line_memo import get_line_memo, save_line_memo, checkpoint_line_memo
+from utils.reading_store import record_confirmed_readings
 from utils.helpers import sleep_minutes, get_resume_index, completed_task
 from models.conversion_log import ConversionLog
-from models.lyrics import Type
+from models.lyrics import Word
+from utils.conversion_cache import CachedConversion, lyrics_key, load_conversion, save_conversion
 from utils.input_utils import prompt_response, prompt_choices
 from utils.logger import get_logger
 from utils.string_utils import extract_lyrics_kai, extract_japanese_lyrics, is_empty
-from web.mgp import MGPPage, replace_lyrics_jap, save_edit, get_page, fetch_pages
+from web.mgp import MGPPage, replace_lyrics_lines, save_edit, get_page, fetch_pages
 from web.vocaloid_lyrics_wiki import get_romaji
-import wikitextparser as wtp
 
 
 def convert_page_text(page: MGPPage, log: ConversionLog) -> Optional[str]:
@@ -27,16 +30,24 @@ def convert_page_text(page: MGPPage, log: ConversionLog) -> Optional[str]:
     :param log: Records of event that happened during conversion
     :return: None if failed. A str object representing the new text if successful.
     """
+    res = convert_page(page, log)
+    return None if res is None else res[0]
+
+
+def convert_page(page: MGPPage, log: ConversionLog) -> Optional[tuple[str, str, Optional[CachedConversion]]]:
+    """
+    Same as convert_page_text, except that the conversion to cache once the edit is saved is returned as well
+    :return: None if failed. Otherwise, the new text, the key of the lyrics in the conversion cache and
+    the conversion to save under it, which is None if the conversion was taken from the cache.
+    """
     # extract the indices of {{LyricsKai...}}
     get_logger().debug("Extracting LyricsKai")
-    parsed = wtp.parse(page.wikitext)
-    lyrics_kai = None
-    need_button = True
-    for t in parsed.templates:
-        if t.name.lower() == "LyricsKai/Roma/button".lower():
-            need_button = False
-        if "lyricskai" in t.name.lower() and t.has_arg("original"):
-            lyrics_kai = t
+    parsed = page.parsed.wikitext
+    need_button = len(page.parsed.templates("LyricsKai/Roma/button")) == 0
+    # LyricsKai or a variant of it; the last one on the page is used
+    candidates = [t for name, templates in page.parsed.build_index().items() if "LYRICSKAI" in name
+                  for t in templates if t.has_arg("original")]
+    lyrics_kai = max(candidates, key=lambda t: t.span[0], default=None)
     if lyrics_kai is None:
         get_logger().error("Failed to extract LyricsKai from page " + page.title)
     # extract the str of the Japanese lyrics
@@ -56,6 +67,42 @@ def convert_page_text(page: MGPPage, log: ConversionLog) -> Optional[str]:
                                            if not is_japanese_lyrics(lyrics_jap)
                                            else "is already translated."))
         return None
+    # lyrics that have been converted before on another page are not converted again
+    key = lyrics_key(lyrics_jap)
+    cached = load_conversion(key)
+    # a conversion taken from the cache is not cached again
+    reused = cached is not None
+    if reused:
+        get_logger().info("Reusing the conversion of identical lyrics for " + str(page))
+        cached.restore(log)
+        line_words = cached.line_words
+    else:
+        line_words = convert_lyrics_lines(page, lyrics_jap, log)
+        if line_words is None:
+            return None
+    # replace Japanese lyrics with the list of words
+    get_logger().debug("Replacing original lyrics with photrans")
+    lyrics_jap = replace_lyrics_lines(lyrics_jap, line_words, log)
+    if len(log.unaligned_lines) > 0 and (config.config.line_strict or not config.config.save_partial_furigana):
+        get_logger().warning("Failed to replace original Kanji with photrans for " + str(page))
+        return None
+    # add photrans button and put everything together
+    lyrics_kai.set_arg("original", prepend.lstrip() + lyrics_jap.rstrip())
+    if need_button:
+        lyrics_kai.string = "{{Photrans/button|float=1}}\n" + lyrics_kai.string
+    # taken after the operator reviewed invalid furigana in replace_lyrics_lines
+    return str(parsed), key, None if reused else CachedConversion.capture(line_words, log)
+
+
+def convert_lyrics_lines(page: MGPPage, lyrics_jap: str, log: ConversionLog) -> Optional[list[Optional[list[Word]]]]:
+    """
+    Find the furigana of every line of Japanese lyrics
+    :param page: The page the lyrics are from
+    :param lyrics_jap: Japanese lyrics on the page
+    :param log: Records of event that happened during conversion
+    :return: A list parallel with the lines of lyrics_jap holding the words of each line, or None for lines
+    without a counterpart on Vocaloid Lyrics Wiki. None if the lyrics cannot be converted.
+    """
     # fetch Japanese and romaji lyrics from Vocaloid Lyrics Wiki
     get_logger().debug("Fetching lyrics from Vocaloid Lyrics Wiki")
     vocaloid_lyrics_wiki = get_romaji(page.song_names, lyrics_jap, log)
@@ -67,30 +114,31 @@ def convert_page_text(page: MGPPage, log: ConversionLog) -> Optional[str]:
     # romaji from Vocaloid Lyrics Wiki to get a list of words containing
     # the original Kanji and the furigana
     get_logger().debug("Converting lyrics to kana")
-    words = convert_kana(lyrics_jap_2, romaji, log, page.id)
-    if not words:
+    line_words = convert_kana_lines(lyrics_jap_2, romaji, log, page.id)
+    if not line_words:
         return None
-    words = [word for word in words if word.type != Type.KANA]
-    # replace Japanese lyrics with the list of words
-    get_logger().debug("Replacing original lyrics with photrans")
-    lyrics_jap = replace_lyrics_jap(lyrics_jap, words, log)
-    if lyrics_jap is None:
-        get_logger().warning("Failed to replace original Kanji with photrans for " + str(page))
-        return None
-    # add photrans button and put everything together
-    lyrics_kai.set_arg("original", prepend.lstrip() + lyrics_jap.rstrip())
-    if need_button:
-        lyrics_kai.string = "{{Photrans/button|float=1}}\n" + lyrics_kai.string
-    return str(parsed)
+    # pair every line on MGP with its counterpart on Vocaloid Lyrics Wiki, since the two
+    # often differ in blank lines, merged lines and repeated choruses
+    mgp_lines = lyrics_jap.split("\n")
+    alignment = align_lines(mgp_lines, lyrics_jap_2)
+    for start, end in unaligned_regions(mgp_lines, alignment):
+        get_logger().warning("No counterpart on Vocaloid Lyrics Wiki for lines {}-{}: {}".format(
+            start + 1, end, " / ".join(mgp_lines[start:end])))
+        log.unaligned_lines.append((start, end))
+    return [None if index is None else line_words[index] for index in alignment]
 
 
 def get_edit_summary(logs: ConversionLog):
     logs_list = ["{}:{}=>{}".format(w1.surface, w1.hiragana, w2.hiragana)
-                 for w1, w2 in logs.used_conversions if w2.hiragana not in get_pronunciations(w2.surface)]
+                 for w1, w2 in logs.used_conversions if not is_valid_reading(w2.surface, w2.hiragana)]
     logs_list = list(set(logs_list))
     logs_list.extend(["{}:{}≠>{}".format(w1.surface, w1.hiragana, w2.hiragana)
                       for w1, w2 in logs.removed_conversions])
     logs_list.extend(["{}:?".format(c) for c in set(logs.ignored_kanji)])
+    # lines left without furigana
+    for start, end in sorted(set(logs.unaligned_lines)):
+        lines = str(start + 1) if end == start + 1 else "{}-{}".format(start + 1, end)
+        logs_list.append("第{}行未注音".format(lines))
     return "添加注音（由[[User:Lihaohong/注音机器人|机器人]]自动添加）({})".format(";".join(logs_list))
 
 
@@ -102,10 +150,18 @@ def process_page(page: MGPPage) -> bool:
     """
     # log events during conversion to be shown in edit summary
     logs = ConversionLog()
-    text = convert_page_text(page, logs)
-    if text:
-        return save_edit(text, page, get_edit_summary(logs), confirm=True, minor=False)
-    return False
+    res = convert_page(page, logs)
+    checkpoint_line_memo()
+    if res is None:
+        return False
+    text, key, cached = res
+    saved = save_edit(text, page, get_edit_summary(logs), confirm=True, minor=False)
+    # a rejected conversion is neither reused nor learned from; one taken from the cache
+    # had its readings recorded when it was first saved
+    if saved and cached is not None:
+        save_conversion(key, cached)
+        record_confirmed_readings(logs.final_words)
+    return saved
 
 
 def process_song(page_name: str) -> bool:
@@ -147,4 +203,12 @@ def manual_mode():
 
 
 def auto_furigana():
-    run_vj_bot(process_song)
+    warm_up()
+    try:
+        run_vj_bot(process_song)
+    finally:
+        # lines memoised since the last periodic save
+        save_line_memo()
+    get_logger().info(get_line_memo().summary())
+    for summary in pool_summaries():
+        get_logger().info(summary)
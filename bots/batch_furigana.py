@@ -0,0 +1,89 @@
+import argparse
+from pathlib import Path
+from typing import Iterator, Optional
+
+from models.conversion_log import ConversionLog
+from utils.batch_furigana import Song, convert_songs, words_to_photrans
+from utils.caching import init_caching
+from utils.logger import setup_logger, get_logger
+from utils.string_utils import extract_lyrics_kai, extract_japanese_lyrics
+
+# separates the Japanese lyrics from the romaji in a lyrics file
+LYRICS_FILE_SEPARATOR = "----"
+
+
+def read_lyrics_file(path: Path) -> Optional[Song]:
+    """
+    Read a song from a local file with the Japanese lyrics, a line of LYRICS_FILE_SEPARATOR and the romaji
+    :param path: Path to the file
+    :return: The song, or None if the file is malformed
+    """
+    lines = path.read_text(encoding="utf-8").split("\n")
+    if LYRICS_FILE_SEPARATOR not in lines:
+        get_logger().warning("{} does not separate the lyrics from the romaji with {}".format(
+            path, LYRICS_FILE_SEPARATOR))
+        return None
+    index = lines.index(LYRICS_FILE_SEPARATOR)
+    jap, romaji = lines[:index], lines[index + 1:]
+    if len(jap) != len(romaji):
+        get_logger().warning("{} has {} lines of lyrics but {} lines of romaji".format(path, len(jap), len(romaji)))
+        return None
+    return Song(path.stem, jap, romaji)
+
+
+def fetch_song(page_name: str) -> Optional[Song]:
+    """
+    Fetch the Japanese lyrics of a MGP page and the lyrics and romaji of the song on Vocaloid Lyrics Wiki
+    :param page_name: Name of the page
+    :return: The lyrics from Vocaloid Lyrics Wiki, or None if they cannot be found
+    """
+    from web.mgp import get_page
+    from web.vocaloid_lyrics_wiki import get_romaji
+    page = get_page(page_name)
+    text = page.wikitext
+    lyrics_kai = extract_lyrics_kai(text)
+    if lyrics_kai is None:
+        get_logger().warning("Failed to extract LyricsKai from page " + page_name)
+        return None
+    text = text[lyrics_kai[0]:lyrics_kai[1]]
+    lyrics = extract_japanese_lyrics(text)
+    if lyrics is None:
+        get_logger().warning("Failed to extract Japanese lyrics from page " + page_name)
+        return None
+    res = get_romaji(page.song_names, text[lyrics[0]:lyrics[1]].strip(), ConversionLog())
+    if res is None:
+        get_logger().warning("Failed to fetch lyrics for " + page_name + " from Vocaloid Lyrics Wiki.")
+        return None
+    jap, romaji = res
+    return Song(page_name, jap, romaji, str(page.id))
+
+
+def load_songs(names: list[str], files: bool) -> Iterator[Song]:
+    for name in names:
+        song = read_lyrics_file(Path(name)) if files else fetch_song(name)
+        if song is not None:
+            yield song
+
+
+def main(args: list[str] = None):
+    parser = argparse.ArgumentParser(description="Add furigana to many songs at once using all CPUs.")
+    parser.add_argument("names", nargs="+", help="names of MGP pages, or paths of lyrics files with --files")
+    parser.add_argument("--files", action="store_true",
+                        help="read lyrics files with the Japanese lyrics, a line of " + LYRICS_FILE_SEPARATOR +
+                             " and the romaji instead of fetching pages")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--chunk-lines", type=int, default=None, help="most lines matched by a worker at once")
+    parsed = parser.parse_args(args)
+    setup_logger()
+    init_caching()
+    for result in convert_songs(load_songs(parsed.names, parsed.files), parsed.workers, parsed.chunk_lines):
+        print("== {} ==".format(result.name))
+        if result.lines is None:
+            print("Failed to convert {}".format(result.name))
+            continue
+        for line in result.lines:
+            print(words_to_photrans(line))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,15 @@ import requests
 from pywikibot import Page
 
 from bots.common import run_vj_bot
-from utils.wikitext import get_template_by_name
+from utils.string_utils import scan_templates
 from web.mgp import get_pages_embedded, MGPPage
-import wikitextparser as wtp
 
 
 def process_page(page_name: str):
     page = MGPPage(page_name)
-    parsed = wtp.parse(page.wikitext)
-    templates = get_template_by_name(parsed, "BilibiliVideo")
+    templates = scan_templates(page.wikitext, "BilibiliVideo")
     for t in templates:
-        bid = t.get_arg("id").value
+        bid = t.get_arg("id")
         response = requests.get("https://www.bilibili.com/video/" + bid).text
         parsed = bs4.BeautifulSoup(response, "html.parser")
         errors = parsed.find_all("div", {"class": "error-body"})
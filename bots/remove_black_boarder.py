@@ -4,12 +4,11 @@ from pathlib import Path
 
 import numpy as np
 import requests
-import wikitextparser as wtp
 
 from bots.common import run_vj_bot
 from utils.image import download_file
 from utils.logger import get_logger
-from utils.wikitext import get_template_by_name
+from utils.string_utils import scan_templates
 from web.mgp import get_page
 
 
@@ -43,14 +42,13 @@ def remove_black_boarders(image_in: str, image_out: str, crop_threshold: float)
 
 
 def get_image_names(text: str) -> list[str]:
-    parsed = wtp.parse(text)
-    song_boxes = get_template_by_name(parsed, "VOCALOID_Songbox")
+    song_boxes = scan_templates(text, "VOCALOID_Songbox")
     result = []
     for song_box in song_boxes:
         arg = song_box.get_arg("image")
         if arg is None:
             continue
-        result.append(arg.value)
+        result.append(arg)
     return result
 
 
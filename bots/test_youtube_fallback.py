@@ -3,7 +3,7 @@ from unittest import TestCase
 import wikitextparser
 from wikitextparser import Template
 
-from bots.youtube_fallback import update_yt_count, add_youtube_count, convert_views, find_youtube_count
+from bots.youtube_fallback import update_yt_count, transform_wikitext, convert_views, find_youtube_count
 from web.youtube import get_yt_views
 
 
@@ -38,9 +38,8 @@ class Test(TestCase):
         expected = f"""{{{{VOCALOID_Songbox
 |yt_id = Gexhf83mq3M
 |其他资料 = 于同日投稿至YouTube，再生数为{{{{YoutubeCount|id=Gexhf83mq3M}}}}<br/>于}}}}"""
-        t = Template(wikitext)
-        add_youtube_count(t, "")
-        self.assertEqual(expected, t.string)
+        self.assertEqual(expected, transform_wikitext("", wikitext))
+        self.assertIsNone(transform_wikitext("", expected))
 
     def test_find_youtube_count(self):
         text = "于2015年6月25日投稿至niconico、YouTube<br/>" \
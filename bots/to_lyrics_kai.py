@@ -4,7 +4,6 @@ import time
 import urllib
 import webbrowser
 
-import wikitextparser as wtp
 from wikitextparser import Template
 
 from bots.common import run_vj_bot, run_with_waf, throttle
@@ -13,7 +12,7 @@ from utils.input_utils import prompt_response, prompt_choices
 from utils.japanese_utils import furigana_local
 from utils.logger import get_logger
 from utils.string_utils import is_empty, strip_each_line
-from utils.wikitext import get_template_by_name
+from utils.wikitext import ParsedPage, as_parsed_page, ArgumentIndex
 from web.mgp import get_page, save_edit, get_pages_embedded
 
 hover: bool = True
@@ -126,18 +125,12 @@ def lyrics_to_lyrics_kai(lyrics: Lyrics, song_name: str) -> str | None:
 def lyrics_to_lyrics(lyrics: Template) -> Lyrics | None:
     original = []
     translated = []
-    for i in range(1, 1000):
-        if lyrics.has_arg(f"lb-color{i}") or lyrics.has_arg(f"rb-color{i}"):
-            return None
-        left_arg, right_arg = f"lb-text{i}", f"rb-text{i}"
-        if not lyrics.has_arg(left_arg):
-            left = ""
-        else:
-            left = lyrics.get_arg(left_arg).value
-        if lyrics.has_arg(right_arg):
-            right = lyrics.get_arg(right_arg).value
-        else:
-            right = ""
+    arguments = ArgumentIndex(lyrics)
+    if len(arguments.numbered("lb-color", "rb-color")) > 0:
+        return None
+    for _, (left_arg, right_arg) in arguments.numbered("lb-text", "rb-text"):
+        left = "" if left_arg is None else left_arg.value
+        right = "" if right_arg is None else right_arg.value
         if is_empty(left) and is_empty(right):
             continue
         left, right = left.strip(), right.strip()
@@ -153,7 +146,7 @@ def lyrics_to_lyrics(lyrics: Template) -> Lyrics | None:
                 ("author", "author")]
     args = {}
     for arg in arg_list:
-        argument = lyrics.get_arg(arg[1])
+        argument = arguments.get(arg[1])
         if argument is None or is_empty(argument.value):
             continue
         args[arg[0]] = argument.value.strip()
@@ -172,17 +165,22 @@ def convert_lyrics(lyrics: Template, song_name) -> str | None:
     return lyrics_to_lyrics_kai(converted, song_name)
 
 
-def transform_wikitext(text, song_name) -> str | None:
-    parsed = wtp.parse(text)
-    lyrics = get_template_by_name(parsed, "Lyrics")
+def transform_wikitext(text: str | ParsedPage, song_name) -> str | None:
+    parsed = as_parsed_page(text)
+    lyrics = parsed.templates("Lyrics")
     changed = False
     for t in lyrics:
-        if len(get_template_by_name(t, "color")) > 0 or len(get_template_by_name(t, "cj")) > 0:
+        if len(parsed.templates_in(t, "color")) > 0 or len(parsed.templates_in(t, "cj")) > 0:
             later(song_name)
+            # earlier Lyrics templates may have been converted already
+            if changed:
+                parsed.discard_changes()
             return None
         res = convert_lyrics(t, song_name)
         if res is not None:
             t.string = res
+            # templates inside t were replaced
+            parsed.invalidate()
             changed = True
     return str(parsed) if changed else None
 
@@ -198,7 +196,7 @@ def process_song(song_name: str):
     #     global add_furigana
     #     add_furigana = 1 == prompt_choices("Add furigana?", ["Yes", "No"])
     page = get_page(song_name)
-    res = transform_wikitext(page.wikitext, song_name)
+    res = transform_wikitext(page.parsed, song_name)
     if res is None:
         return
     wikitext = str(res)
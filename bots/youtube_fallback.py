@@ -9,11 +9,9 @@ from bots.common import run_vj_bot, run_with_waf
 from utils.helpers import get_resume_index, completed_task
 from utils.input_utils import prompt_choices, prompt_response
 from utils.logger import get_logger, log_str
-from utils.string_utils import is_empty
-from utils.wikitext import get_template_by_name, title_equal
+from utils.string_utils import is_empty, scan_templates, apply_patches, Patch, TemplateSpan
+from utils.wikitext import title_equal, ArgumentIndex
 from web.mgp import fetch_pages, get_page, save_edit
-import wikitextparser as wtp
-from wikitextparser import WikiText
 
 from web.youtube import get_yt_views
 
@@ -34,8 +32,9 @@ def convert_views(views: int, fallback: str) -> Optional[int]:
 
 
 def update_yt_count(yt_count: Template, song_name: str) -> bool:
-    fallback = yt_count.get_arg("fallback")
-    vid = yt_count.get_arg("id")
+    arguments = ArgumentIndex(yt_count)
+    fallback = arguments.get("fallback")
+    vid = arguments.get("id")
     if vid is None:
         get_logger().warning(song_name + " has no id in YT Count template.")
         return False
@@ -115,51 +114,57 @@ def find_youtube_count(text: str, song_name: str = "Unknown", log_error: bool =
     return None
 
 
-def replace(arg: Argument, yt_id: str, song_name: str) -> bool:
-    if arg is None:
-        return False
-    text = arg.value
-    res = find_youtube_count(text, song_name)
+def youtube_count_template(yt_id: str) -> str:
+    return "{{" + f"YoutubeCount|id={yt_id}" + "}}"
+
+
+def youtube_count_patch(song_box: TemplateSpan, arg_name: str, yt_id: str, song_name: str) -> Optional[Patch]:
+    """
+    Replace the view count in an argument of a song box with a YoutubeCount template
+    :return: The replacement as a patch to the text of the song box, or None if there is no view count.
+    """
+    span = song_box.arguments.get(arg_name)
+    if span is None:
+        return None
+    res = find_youtube_count(song_box.text[span[0]:span[1]], song_name)
     if res is None:
-        return False
+        return None
     num_start, num_end = res
-    template = "{{" + f"YoutubeCount|id={yt_id}" + "}}"
-    arg.value = text[:num_start] + template + text[num_end:]
-    return True
+    return span[0] + num_start, span[0] + num_end, youtube_count_template(yt_id)
 
 
-def add_youtube_count(song_box: Template, song_name: str) -> bool:
+def youtube_count_patches(song_box: TemplateSpan, song_name: str) -> list[Patch]:
     yt_id = song_box.get_arg("yt_id")
     if yt_id is None:
-        return False
-    yt_id = yt_id.value.strip()
+        return []
+    yt_id = yt_id.strip()
     # try to find the raw view count
     yt_views = get_yt_views(yt_id)
     if yt_views is None:
-        return False
-    res = replace(song_box.get_arg("其他资料"), yt_id, song_name)
-    res2 = replace(song_box.get_arg("再生"), yt_id, song_name)
-    result = res or res2
-    if not result:
+        return []
+    patches = [youtube_count_patch(song_box, "其他资料", yt_id, song_name),
+               youtube_count_patch(song_box, "再生", yt_id, song_name)]
+    patches = [p for p in patches if p is not None]
+    if len(patches) == 0:
         log_str("revisit.txt", song_name)
-    return result
+    return patches
 
 
-def transform_wikitext(song_name: str, wikitext: str) -> Optional[WikiText]:
-    parsed = wtp.parse(wikitext)
-    song_boxes = get_template_by_name(parsed, "VOCALOID_Songbox")
-    changed = False
+def transform_wikitext(song_name: str, wikitext: str) -> Optional[str]:
+    # only the song boxes are looked at, so the page is scanned instead of parsed
+    song_boxes = scan_templates(wikitext, "VOCALOID_Songbox")
+    yt_counts = scan_templates(wikitext, "YoutubeCount")
+    patches = []
     for song_box in song_boxes:
-        yt_count_list = get_template_by_name(song_box, "YoutubeCount")
+        yt_count_list = [t for t in yt_counts if song_box.contains(t)]
         if len(yt_count_list) == 0:
-            res = add_youtube_count(song_box, song_name)
-            changed = res or changed
+            patches.extend(youtube_count_patches(song_box, song_name))
             continue
         # disabled because no longer needed
         # for yt_count in yt_count_list:
         #     res = update_yt_count(yt_count, song_name)
         #     changed = res or changed
-    return parsed if changed else None
+    return apply_patches(wikitext, patches) if len(patches) > 0 else None
 
 
 def process_song(song_name: str):
@@ -12,10 +12,34 @@ class Mode(Enum):
 waf_sleep: int = 15
 mode: Mode = Mode.AUTO_FURIGANA
 line_strict: bool = False
+# save pages some of whose lines have no counterpart on Vocaloid Lyrics Wiki, leaving those lines without furigana;
+# otherwise such pages are skipped
+save_partial_furigana: bool = False
 skip_words_in_replacement: int = 3
 replacement_redo_limit = 5
 alert_input = False
 ignore_minor_diff = True
+# lines estimated to cost more than this many work units are aligned with beam search
+line_exhaustive_search_limit: int = 20000
+line_search_beam_width: int = 32
+# lines that take more work than this keep Yahoo's reading
+line_search_budget: int = 200000
+# number of aligned lines remembered across songs and runs
+line_memo_size: int = 100000
+# the line memo is saved after this many pages and when the bot exits
+line_memo_save_interval: int = 20
+# typos tolerated in the romaji of each kana word when a line cannot be matched exactly; 0 disables it
+fuzzy_anchor_errors: int = 1
+# a learned reading replaces Yahoo's after it has been confirmed this many times
+# and makes up this share of the confirmed readings of the word
+reading_store_min_count: int = 3
+reading_store_min_share: float = 0.9
+# most pykakasi converters open at once; threads beyond that wait
+kakasi_pool_size: int = 4
+# worker processes of batch conversion; 0 uses one per CPU
+batch_workers: int = 0
+# songs longer than this many lines are split between workers
+batch_chunk_lines: int = 40
 
 
 def get_mode() -> Mode:
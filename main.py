@@ -1,31 +1,53 @@
+import importlib
+import sys
+import time
+from typing import Callable
+
 import pywikibot
 
 import config.config
-from bots.auto_furigana import auto_furigana
-from bots.bilibili_video import bilibili_video
-from bots.replace_links import replace_links
-from bots.to_lyrics_kai import lyrics_kai
-from bots.youtube_fallback import youtube_fallback
 from config.config import Mode
 from utils import login
 from utils.caching import init_caching
-from utils.logger import setup_logger
+from utils.logger import setup_logger, get_logger
 
 site = pywikibot.Site()
 
+# bots are imported on demand so that each mode only pays for what it uses
+modes: dict[Mode, tuple[str, str]] = {
+    Mode.AUTO_FURIGANA: ("bots.auto_furigana", "auto_furigana"),
+    Mode.AUTO_YOUTUBE_FALLBACK: ("bots.youtube_fallback", "youtube_fallback"),
+    Mode.AUTO_LYRICS_KAI: ("bots.to_lyrics_kai", "lyrics_kai"),
+    Mode.BILIBILI_VIDEO: ("bots.bilibili_video", "bilibili_video"),
+    Mode.REPLACE_LINKS: ("bots.replace_links", "replace_links")
+}
+heavy_modules = ["wikitextparser", "bs4", "numpy", "jamdict", "pykakasi"]
+
+
+def load_mode(mode: Mode) -> Callable[[], None]:
+    """
+    Import the bot of a mode and report what the import loaded
+    :param mode: The mode to run
+    :return: The entry point of the bot
+    """
+    module_name, function_name = modes[mode]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    elapsed = time.perf_counter() - start
+    loaded = [m for m in heavy_modules if m in sys.modules]
+    resources = []
+    if "utils.japanese_char" in sys.modules:
+        resources = sys.modules["utils.japanese_char"].loaded_resources()
+    get_logger().info("Startup of {} took {:.2f}s. Libraries: {}. Japanese resources: {}.".format(
+        mode.name, elapsed, ", ".join(loaded) or "none", ", ".join(resources) or "none"))
+    return getattr(module, function_name)
+
 
 def main():
     setup_logger()
     init_caching()
     login.main()
-    m = {
-        Mode.AUTO_FURIGANA: auto_furigana,
-        Mode.AUTO_YOUTUBE_FALLBACK: youtube_fallback,
-        Mode.AUTO_LYRICS_KAI: lyrics_kai,
-        Mode.BILIBILI_VIDEO: bilibili_video,
-        Mode.REPLACE_LINKS: replace_links
-    }
-    m[config.config.mode]()
+    load_mode(config.config.mode)()
 
 
 if __name__ == "__main__":
@@ -13,7 +13,13 @@ class ConversionLog:
     invalid_conversions: ConversionList = field(default_factory=list)
     removed_conversions: ConversionList = field(default_factory=list)
     all_words: list[Word] = field(default_factory=list)
+    final_words: list[Word] = field(default_factory=list)
     ignored_kanji: list[str] = field(default_factory=list)
+    budget_exceeded_lines: list[str] = field(default_factory=list)
+    # ranges of lines of the page without a counterpart in the source of the romaji
+    unaligned_lines: list[tuple[int, int]] = field(default_factory=list)
+    # words that were converted but found no place in the lyrics
+    unplaced_words: list[Word] = field(default_factory=list)
 
     def word_used(self, word: Word):
         self.all_words.append(word)
@@ -64,6 +64,28 @@ katakana_dict = {'ア': 'a', 'イ': 'i', 'ウ': 'u', 'ヴ': 'vu', 'ヴァ': 'va'
                   'ヰ': 'wi', 'ヱ': 'we', 'ウェ': 'we', 'ヲ': 'wo', 'ウォ': 'wo', 'ン': "n", 'ディ': 'di',
                   'チェ': 'che', 'ジェ': 'je'}
 
+# kana with more than one accepted romanisation, or none in the tables above
+special_romaji = {
+    'へ': ['he', 'e'],
+    'ヲ': ['wo', 'o'],
+    'を': ['wo', 'o'],
+    'は': ['ha', 'wa'],
+    'ふ': ['fu', 'hu'],
+    'フ': ['fu', 'hu'],
+    'づ': ['zu'],
+    'ぢ': ['ji'],
+    'ぁ': ['a'],
+    'ぃ': ['i'],
+    'ぅ': ['u'],
+    'ぇ': ['e'],
+    'ぉ': ['o'],
+    'ァ': ['a'],
+    'ィ': ['i'],
+    'ゥ': ['u'],
+    'ェ': ['e'],
+    'ォ': ['o']
+}
+
 hiragana_dict = TwoWayDict()
 
 for k in hiragana_table:
@@ -0,0 +1,13 @@
+from unittest import TestCase
+
+from utils.aho_corasick import AhoCorasick
+
+
+class Test(TestCase):
+    def test_find_all(self):
+        automaton = AhoCorasick(["he", "she", "his", "hers"])
+        self.assertEqual([(1, 1), (2, 0), (2, 3)], list(automaton.find_all("ushers")))
+        self.assertEqual([], list(automaton.find_all("xyz")))
+        automaton = AhoCorasick(["下手", "手", "下手くそ"])
+        self.assertEqual([(0, 0), (1, 1), (0, 2)], list(automaton.find_all("下手くそ")))
+        self.assertRaises(ValueError, AhoCorasick, [""])
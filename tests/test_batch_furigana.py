@@ -0,0 +1,47 @@
+import json
+from unittest import TestCase
+
+from models.conversion_log import ConversionLog
+from utils.batch_furigana import Song, convert_songs, split_chunks, words_to_photrans
+from utils.caching import cache_path, init_caching
+from utils.japanese_utils import convert_kana_lines
+
+yahoo_response = {"result": {"word": [{"surface": "夏空", "furigana": "なつぞら"}, {"surface": "を"},
+                                      {"surface": "\n"}, {"surface": "人", "furigana": "ひと"},
+                                      {"surface": "って"}, {"surface": "\n"},
+                                      {"surface": "明日", "furigana": "あした"}, {"surface": "へ"}]}}
+
+
+class Test(TestCase):
+    page_id = "test_batch_furigana"
+
+    def setUp(self):
+        init_caching()
+        self.cache_file = cache_path.joinpath("Yahoo" + self.page_id + ".json")
+        self.cache_file.write_text(json.dumps(yahoo_response), encoding="utf-8")
+
+    def tearDown(self):
+        self.cache_file.unlink()
+
+    def test_split_chunks(self):
+        tasks = [([], str(i)) for i in range(5)]
+        self.assertEqual([tasks], split_chunks(tasks, 5))
+        self.assertEqual([tasks[0:2], tasks[2:4], tasks[4:]], split_chunks(tasks, 2))
+
+    def test_convert_songs(self):
+        jap = ["夏空を", "人って", "明日へ"]
+        romaji = ["natsuzorawo", "hitotte", "asue"]
+        songs = [Song(str(i), jap, romaji, self.page_id) for i in range(3)]
+        expected = convert_kana_lines(jap, romaji, ConversionLog(), self.page_id)
+        results = list(convert_songs(songs, workers=2, chunk_lines=1))
+        self.assertEqual(["0", "1", "2"], [r.name for r in results])
+        for r in results:
+            self.assertEqual(expected, r.lines)
+            self.assertEqual(["あす"],
+                             [after.hiragana for _, after in r.logs.word_conversions])
+        self.assertEqual("{{photrans|明日|あす}}へ", words_to_photrans(results[0].lines[2]))
+        # lyrics that Yahoo's words do not spell fail on their own
+        songs.insert(1, Song("mismatch", ["夏空を", "人って", "未来へ"], romaji, self.page_id))
+        results = list(convert_songs(songs, workers=2))
+        self.assertEqual(["0", "mismatch", "1", "2"], [r.name for r in results])
+        self.assertEqual([True, False, True, True], [r.lines is not None for r in results])
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from models.conversion_log import ConversionLog
+from models.lyrics import Word, Type
+from utils.conversion_cache import lyrics_key, CachedConversion
+
+
+class Test(TestCase):
+    def test_lyrics_key(self):
+        key = lyrics_key("花が咲く\n\n空を見る")
+        self.assertEqual(key, lyrics_key("花が咲く、 \n\n空を見る!"))
+        self.assertEqual(key, lyrics_key("{{photrans|花|はな}}が咲く\n\n空を見る"))
+        self.assertNotEqual(key, lyrics_key("花が咲く\n空を見る"))
+        self.assertNotEqual(key, lyrics_key("花が咲く空を見る"))
+        self.assertNotEqual(key, lyrics_key("花が咲く\n\n空を見た"))
+
+    def test_capture_restore(self):
+        line_words = [[Word("花", Type.KANJI, hiragana="はな"), Word("が", Type.KANA)], None]
+        conversion = (Word("花", Type.KANJI, hiragana="か"), line_words[0][0])
+        log = ConversionLog(word_conversions=[conversion], ignored_kanji=["咲"], unaligned_lines=[(1, 2)])
+        cached = CachedConversion.capture(line_words, log)
+        log.word_conversions.clear()
+        restored = ConversionLog()
+        cached.restore(restored)
+        self.assertEqual([conversion], restored.word_conversions)
+        self.assertEqual(["咲"], restored.ignored_kanji)
+        self.assertEqual([(1, 2)], restored.unaligned_lines)
+        self.assertIs(line_words, cached.line_words)
+
+    def test_capture_removed(self):
+        # the operator took back 花: か => はな, so the cached words read か and no longer ask about it
+        before = Word("花", Type.KANJI, hiragana="か")
+        chorus = [Word("花", Type.KANJI, hiragana="はな"), Word("が", Type.KANA)]
+        line_words = [chorus, None, chorus]
+        conversion = (before, chorus[0])
+        log = ConversionLog(word_conversions=[conversion], removed_conversions=[conversion])
+        cached = CachedConversion.capture(line_words, log)
+        self.assertEqual(["か", ""], [w.hiragana for w in cached.line_words[0]])
+        self.assertIs(cached.line_words[0], cached.line_words[2])
+        self.assertEqual("はな", chorus[0].hiragana)
+        restored = ConversionLog()
+        cached.restore(restored)
+        self.assertEqual([], restored.word_conversions)
+        self.assertEqual([conversion], restored.removed_conversions)
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from utils.fuzzy_match import substring_edit_distances, fuzzy_find
+
+
+class Test(TestCase):
+    def test_substring_edit_distances(self):
+        d = substring_edit_distances("wo", "awxo", 1)
+        self.assertEqual((5, 4), d.shape)
+        self.assertEqual(1, d[1, 1])
+        self.assertEqual(1, d[1, 2])
+        self.assertEqual(1, d[1, 3])
+        self.assertEqual(2, d[3, 0])
+        self.assertEqual(2, d[3, 3])
+        self.assertEqual(1, substring_edit_distances("", "ab", 1)[0, 1])
+
+    def test_fuzzy_find(self):
+        self.assertEqual({6: {8: 0}}, fuzzy_find(["wo"], "natsuzwosenmei", 0))
+        self.assertEqual({5: {7: 1}, 6: {7: 1}, 9: {10: 1, 11: 1}}, fuzzy_find(["wo"], "natsuzorawsenmei", 1))
+        self.assertEqual({}, fuzzy_find(["o"], "abc", 1))
+
+    def test_lazy_import(self):
+        # matching lines must not load numpy until a typo has to be searched for
+        code = "import sys, utils.japanese_utils; print('numpy' in sys.modules)"
+        res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual("False", res.stdout.strip())
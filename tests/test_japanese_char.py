@@ -1,6 +1,9 @@
+import subprocess
+import sys
 import unittest
 
-from utils.japanese_char import get_pronunciations
+from utils.japanese_char import get_pronunciations, get_pronunciation_lattice, get_word_kana_priorities, priority_score, is_valid_reading, get_kanji_readings, get_word_kana, preload_word_kana, \
+    classify, count_class, find_class_spans, is_kanji, is_katakana, KANJI, KANA, HIRAGANA, KATAKANA
 
 
 class MyTestCase(unittest.TestCase):
@@ -8,6 +11,54 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(["ひと", "り", "と", "じん", "にん"], get_pronunciations("人"))
         self.assertEqual(['よかい', 'せいかい', 'せかい', 'そうかい'], get_pronunciations("世界"))
 
+    def test_get_pronunciation_lattice(self):
+        lattice = get_pronunciation_lattice("世界", variants=False)
+        self.assertEqual(set(get_pronunciations("世界")), set(lattice.variants()))
+        self.assertTrue(lattice.accepts("せかい"))
+        self.assertFalse(lattice.accepts("せか"))
+        self.assertTrue(is_valid_reading("人々", "ひとびと", variants=True))
+        self.assertTrue(is_valid_reading("夏花", "なつばな", variants=True))
+        self.assertTrue(is_valid_reading("一鳥", "いっちょう", variants=True))
+        self.assertFalse(is_valid_reading("一鳥", None, variants=True))
+        # variants are only considered when asked for, so such readings still go up for review
+        self.assertFalse(is_valid_reading("一鳥", "いっちょう"))
+        self.assertFalse(get_pronunciation_lattice("一鳥", variants=False).accepts("いっちょう"))
+
+    def test_get_kanji_readings(self):
+        self.assertEqual({"ひと", "り", "と", "じん", "にん"}, set(get_kanji_readings("人")))
+        self.assertIsNone(get_kanji_readings("a"))
+
+    def test_get_word_kana(self):
+        self.assertIn("せかい", get_word_kana("世界"))
+        self.assertEqual([], get_word_kana("世界世界"))
+        preload_word_kana(["世界", "夏空", "世界世界"])
+        self.assertIn("なつぞら", get_word_kana("夏空"))
+        self.assertEqual([], get_word_kana("世界世界"))
+
+    def test_word_kana_priorities(self):
+        self.assertEqual(0, priority_score(None))
+        self.assertEqual(50 + 20 + 39, priority_score("news1,ichi2,nf10"))
+        readings = get_word_kana_priorities("人")
+        self.assertEqual(sorted(readings, key=lambda p: p[1], reverse=True), readings)
+        self.assertEqual(["ひと"], [kana for kana, _ in readings if kana in ["ひと", "と"]][:1])
+
+    def test_character_classes(self):
+        self.assertTrue(is_kanji("々"))
+        self.assertFalse(is_kanji("人人"))
+        self.assertFalse(is_katakana("・"))
+        s = "下手くそなカナ・abc𠮷人"
+        self.assertEqual(bytes([KANJI, KANJI, HIRAGANA, HIRAGANA, HIRAGANA, KATAKANA, KATAKANA,
+                                0, 0, 0, 0, 0, KANJI]), classify(s))
+        self.assertEqual(3, count_class(s, KANJI))
+        self.assertEqual([(0, 2), (12, 13)], find_class_spans(s, KANJI))
+        self.assertEqual([(2, 7)], find_class_spans(s, KANA))
+
+    def test_lazy_resources(self):
+        code = "import sys, utils.japanese_char as j; " \
+               "print(j.loaded_resources(), 'jamdict' in sys.modules, 'pykakasi' in sys.modules)"
+        res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual("[] False False", res.stdout.strip())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,10 @@
 from unittest import TestCase
 from utils.japanese_utils import *
 from utils.japanese_char import romaji_to_hiragana
+import config.config
+import utils.reading_store
+from utils.line_memo import GivenUp
+from utils.reading_store import ReadingStore
 
 
 class Test(TestCase):
@@ -20,6 +24,111 @@ class Test(TestCase):
         romaji = "demoiinjanai"
         print(convert_kana_line(words, romaji))
 
+    def test_align_words_with_romaji(self):
+        words = [Word(surface="夏空", type=Type.KANJI, hiragana="なつぞら"),
+                 Word(surface="を", type=Type.KANA),
+                 Word(surface="鮮明", type=Type.KANJI, hiragana="せんめい"),
+                 Word(surface="に", type=Type.KANA)]
+        line = convert_kana_line(words, "natsuzoraosenmeini")
+        self.assertEqual(["なつぞら", "", "せんめい", ""], [w.hiragana for w in line])
+        line = convert_kana_line(words, "natsusorawosenmeini")
+        self.assertEqual("なつそら", line[0].hiragana)
+        self.assertEqual((-10, line), align_words_with_romaji(words, "natsusorawosenmeini"))
+        self.assertIsNone(align_words_with_romaji(words, "natsuzorasenmei"))
+        chorus = [Word(surface="花", type=Type.KANJI, hiragana="はな"), Word(surface="を", type=Type.KANA)] * 20
+        self.assertIsNotNone(convert_kana_line(chorus, "hanao" * 20))
+        # a kana without romaji does not skip any, so the kanji after it still gets romaji
+        line = match_line([Word(surface="ー", type=Type.KANA), Word(surface="歌", type=Type.KANJI, hiragana="うた")],
+                          "sora")
+        self.assertEqual("そら", line[1][1].hiragana)
+        self.assertIsNone(match_non_kana_with_romaji([Word(surface="歌", type=Type.KANJI, romaji=[""])], ""))
+
+    def test_reading_candidates(self):
+        self.assertEqual("かすみ", rank_readings("霞")[0][0])
+        words = [Word(surface='花', type=Type.KANJI, romaji=['ka'], hiragana='か'),
+                 Word(surface='霞', type=Type.KANJI, romaji=['gasumi'], hiragana='がすみ')]
+        self.assertEqual(2 * MATCHING_KANA, match_non_kana_with_romaji(words, 'hanakasumi')[0])
+        words = [Word(surface="夏空", type=Type.KANJI, romaji=["natsuzora"], hiragana="なつぞら"),
+                 Word(surface="を", type=Type.KANA, romaji=["o", "wo"])]
+        self.assertTrue(probe_line(words, "natsuzorawo"))
+        self.assertFalse(probe_line(words, "natsusorawo"))
+
+    def test_probe_learned_reading(self):
+        # a learned reading that JMdict does not list is rated like in the full search
+        store = ReadingStore()
+        for _ in range(5):
+            store.record("地球", "ほし")
+        previous = utils.reading_store.reading_store
+        utils.reading_store.reading_store = store
+        try:
+            self.assertEqual(("ほし", ["hoshi"], NON_MATCHING_KANA), reading_candidates("地球")[0])
+            words = [Word(surface="地球", type=Type.KANJI, romaji=["chikyuu"], hiragana="ちきゅう"),
+                     Word(surface="花", type=Type.KANJI, romaji=["hana"], hiragana="はな")]
+            rating, line = match_non_kana_with_romaji(words, "hoshihana")
+            self.assertEqual(NON_MATCHING_KANA, rating)
+            self.assertEqual("ほし", line[0].hiragana)
+        finally:
+            utils.reading_store.reading_store = previous
+
+    def test_fuzzy_anchors(self):
+        words = [Word(surface="夏空", type=Type.KANJI, hiragana="なつぞら"),
+                 Word(surface="を", type=Type.KANA),
+                 Word(surface="鮮明", type=Type.KANJI, hiragana="せんめい"),
+                 Word(surface="に", type=Type.KANA)]
+        self.assertIsNone(align_words_with_romaji(words, "natsuzorawosenmeimi"))
+        matches = find_fuzzy_anchor_matches([words[1], words[3]], "natsuzorawosenmeimi", 1)
+        self.assertEqual(0, matches[0][9][11])
+        self.assertEqual(1, matches[1][17][19])
+        rating, line = align_words_with_romaji(words, "natsuzorawosenmeimi", anchor_matches=matches)
+        self.assertEqual(2 * MATCHING_KANA + FUZZY_ANCHOR_ERROR, rating)
+        self.assertEqual(["なつぞら", "せんめい"], [w.hiragana for w in line if w.type == Type.KANJI])
+        # a typo next to a kanji whose romaji makes no reading of it is not excused
+        words = [Word(surface="を", type=Type.KANA),
+                 Word(surface="今日", type=Type.KANJI, hiragana="きょう"),
+                 Word(surface="から", type=Type.KANA)]
+        self.assertIsNone(match_line(words, "ojinara"))
+        self.assertEqual("きょう", match_line(words, "okyoukar")[1][1].hiragana)
+
+    def test_line_search_budget(self):
+        chorus = [Word(surface="花", type=Type.KANJI, hiragana="はな"), Word(surface="を", type=Type.KANA)] * 20
+        convert_kana_line(chorus, "hanao" * 20)
+        anchor_matches = find_anchor_matches([w for w in chorus if w.type == Type.KANA], "hanao" * 20)
+        self.assertGreater(estimate_line_cost(anchor_matches), estimate_line_cost(anchor_matches[:2]))
+        exhaustive = align_words_with_romaji(chorus, "hanao" * 20)
+        self.assertEqual(exhaustive, align_words_with_romaji(chorus, "hanao" * 20, beam_width=4))
+        self.assertRaises(SearchBudgetExceeded, lambda: align_words_with_romaji(chorus, "hanao" * 20, budget=100))
+        # matching the kanji between the kana is charged too, and the fuzzy pass shares the budget
+        line = [Word(surface="心", type=Type.KANJI, hiragana="こころ"),
+                Word(surface="言葉", type=Type.KANJI, hiragana="ことば"),
+                Word(surface="を", type=Type.KANA)] * 12
+        romaji = "kokorokotobao" * 11 + "kokorokotobo"
+        self.assertRaises(SearchBudgetExceeded, lambda: match_line(line, romaji))
+        budget = SearchBudget(None, "kokorokotoba")
+        match_non_kana_with_romaji(line[:2], "kokorokotoba", budget)
+        self.assertGreater(budget.work, 0)
+        budget = SearchBudget(config.config.line_search_budget, romaji)
+        self.assertRaises(SearchBudgetExceeded, lambda: align_words_with_romaji(line, romaji, budget=budget))
+        self.assertGreater(budget.work, budget.limit)
+
+    def test_given_up_lines_memoised(self):
+        chorus = [Word(surface="花", type=Type.KANJI, hiragana="はな"), Word(surface="を", type=Type.KANA)] * 19
+        romaji = "hanawo" * 18 + "kao"
+        previous = config.config.line_search_budget
+        memo = get_line_memo()
+        try:
+            config.config.line_search_budget = 100
+            self.assertRaises(SearchBudgetExceeded, lambda: convert_kana_line(chorus, romaji))
+            hits = memo.hits
+            # the second attempt gives up without searching again
+            self.assertRaises(SearchBudgetExceeded, lambda: convert_kana_line(chorus, romaji))
+            self.assertEqual(hits + 1, memo.hits)
+            self.assertIsInstance(memo.get(LineMemo.key(chorus, romaji))[1], GivenUp)
+            # a larger budget searches again
+            config.config.line_search_budget = previous
+            self.assertIsNotNone(convert_kana_line(chorus, romaji))
+        finally:
+            config.config.line_search_budget = previous
+
     def test_romaji_to_hiragana(self):
         self.assertEqual("じぶん", romaji_to_hiragana("jibun"))
         self.assertEqual("なに", romaji_to_hiragana("nani"))
@@ -52,6 +161,17 @@ class Test(TestCase):
         words[1].hiragana = "かすみ"
         self.assertEqual((-10, words), res)
 
+    def test_rank_non_kana_matches(self):
+        words = [Word(surface='花', type=Type.KANJI, romaji=['ka'], hiragana='か'),
+                 Word(surface='霞', type=Type.KANJI, romaji=['gasumi'], hiragana='がすみ')]
+        res = rank_non_kana_matches(words, 'hanakasumi', 3)
+        self.assertEqual(3, len(res))
+        self.assertEqual(-20, res[0][0])
+        self.assertEqual(['hana', 'kasumi'], [w.romaji[0] for w in res[0][1]])
+        self.assertTrue(all(res[i][0] >= res[i + 1][0] for i in range(len(res) - 1)))
+        self.assertEqual([], rank_non_kana_matches(words, 'ha', 3))
+        self.assertEqual(res[0], match_non_kana_with_romaji(words, 'hanakasumi'))
+
     def test_jap_line_to_words(self):
         s = "五月蠅い　もううざい　くらいにCryを掻き消す様な"
         kanji = ["五月蠅", "い", "もうう", "ざい", "くらいに", *list("を掻き消す様な")]
@@ -59,6 +179,16 @@ class Test(TestCase):
         jap_line_to_words(s, words)
         self.assertEqual(0, len(words))
 
+    def test_align_yahoo_words(self):
+        words = [Word("夏空", Type.KANJI), Word("を", Type.KANA), Word("人", Type.KANJI),
+                 Word("っ", Type.KANA), Word("て", Type.KANA)]
+        lines = align_yahoo_words(["夏空をCry", "人って"], words)
+        self.assertEqual([["夏空", "を", "Cry"], ["人", "って"]], [[w.surface for w in line] for line in lines])
+        self.assertEqual(5, len(words))
+        with self.assertRaises(WordListMismatch) as cm:
+            align_yahoo_words(["夏空をCry", "人がって"], words)
+        self.assertEqual((1, 1), (cm.exception.line_index, cm.exception.column))
+
     def test_is_fully_translated(self):
         true_list = ["{{PhoTrans|自分|じぶん}}より",
                      "歌名\n{{photrans|啊|b}}ダダダダダ\n{{ruby|好|す}}きていて\n{{photrans|悲|かな}}し",
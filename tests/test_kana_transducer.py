@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from utils.japanese_char import transducer, kana_to_romaji_units
+
+
+class Test(TestCase):
+    def test_to_hiragana(self):
+        self.assertEqual("なっとう", transducer.to_hiragana("nattou"))
+        self.assertEqual("どう", transducer.to_hiragana("doo"))
+        self.assertEqual("せんぱい", transducer.to_hiragana("senpai"))
+        self.assertEqual("ん", transducer.to_hiragana("n"))
+        self.assertIsNone(transducer.to_hiragana("natsuz"))
+        self.assertIsNone(transducer.to_hiragana("xa"))
+
+    def test_is_prefix(self):
+        self.assertTrue(transducer.is_prefix("natsuz"))
+        self.assertTrue(transducer.is_prefix("nkk"))
+        self.assertFalse(transducer.is_prefix("natsuzr"))
+        self.assertFalse(transducer.is_prefix("kq"))
+
+    def test_prefixes(self):
+        self.assertEqual([(0, ""), (1, "ん"), (2, "な"), (5, "なつ")],
+                         list(transducer.prefixes("natsuzra")))
+        self.assertEqual([(3, ""), (5, "そ"), (7, "そら")],
+                         list(transducer.prefixes("natsora", start=3)))
+
+    def test_kana_to_romaji_units(self):
+        self.assertEqual([['ka'], ['h', '', 'p', 'a'], ['pa']], kana_to_romaji_units("かっぱ"))
+        self.assertEqual([['ra'], ['a', ''], ['', '']], kana_to_romaji_units("ラーー"))
+        self.assertEqual([['kya'], ['wo', 'o']], kana_to_romaji_units("きゃを"))
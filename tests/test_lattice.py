@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from utils.japanese_char import kana_to_romaji_lattice
+from utils.lattice import Lattice
+
+
+class Test(TestCase):
+    def test_chain(self):
+        lattice = Lattice.from_units([["ka"], ["h", "", "p", "a"], ["pa"]])
+        self.assertEqual(4, lattice.count_paths())
+        self.assertEqual({"kahpa", "kapa", "kappa", "kaapa"}, set(lattice))
+        self.assertIn("kappa", lattice)
+        self.assertNotIn("kapp", lattice)
+        self.assertEqual([5], lattice.matches("xkapaapa", start=1))
+        self.assertEqual([6], lattice.matches("xkappax", start=1))
+        self.assertEqual([], lattice.matches("kaxpa"))
+
+    def test_dag(self):
+        lattice = Lattice(2)
+        lattice.add(0, 1, "a")
+        lattice.add(1, 2, "b")
+        lattice.add(0, 2, "ab")
+        lattice.add(0, 2, "c")
+        self.assertEqual(["ab", "c"], list(lattice.variants()))
+        self.assertEqual(3, lattice.count_paths())
+        self.assertRaises(ValueError, lambda: lattice.add(1, 1, "x"))
+
+    def test_empty(self):
+        self.assertEqual([""], list(Lattice(0)))
+        self.assertTrue(Lattice(0).accepts(""))
+
+    def test_kana_to_romaji_lattice(self):
+        lattice = kana_to_romaji_lattice("ちょっとをー")
+        self.assertTrue(lattice.accepts("chottoo"))
+        self.assertTrue(lattice.accepts("chotowoo"))
+        self.assertEqual([8, 9], lattice.matches("chottowoo"))
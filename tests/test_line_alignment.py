@@ -0,0 +1,17 @@
+from unittest import TestCase
+
+from utils.line_alignment import line_signature, align_lines, unaligned_regions
+
+
+class Test(TestCase):
+    def test_line_signature(self):
+        self.assertEqual("夏空を鮮明に", line_signature("{{photrans|夏空|なつぞら}}を 鮮明に!"))
+        self.assertEqual("", line_signature("Cry"))
+
+    def test_align_lines(self):
+        mgp = ["{{photrans|夏空|なつぞら}}を鮮明に", "描いた", "恋をした", "ずっと", "描いた", "知らない歌詞"]
+        vlw = ["夏空を 鮮明に", "描いた", "", "恋を した", "ずっと願った"]
+        alignment = align_lines(mgp, vlw)
+        self.assertEqual([0, 1, 3, 4, 1, None], alignment)
+        self.assertEqual([(5, 6)], unaligned_regions(mgp, alignment))
+        self.assertEqual([(0, 3)], unaligned_regions(["人", "", "人"], [None, None, None]))
@@ -0,0 +1,63 @@
+import threading
+from unittest import TestCase
+
+import config.config
+import utils.reading_store
+from models.lyrics import Word, Type
+from utils.line_memo import LineMemo, GivenUp
+from utils.reading_store import ReadingStore
+
+
+class Test(TestCase):
+    def test_line_memo(self):
+        memo = LineMemo(2)
+        words = [Word("花", Type.KANJI, hiragana="はな"), Word("を", Type.KANA)]
+        key = LineMemo.key(words, "hanao")
+        self.assertNotEqual(key, LineMemo.key(words, "hanawo"))
+        self.assertNotEqual(key, LineMemo.key([Word("花", Type.KANJI, hiragana="か"), words[1]], "hanao"))
+        previous = config.config.fuzzy_anchor_errors
+        config.config.fuzzy_anchor_errors = previous + 1
+        try:
+            self.assertNotEqual(key, LineMemo.key(words, "hanao"))
+        finally:
+            config.config.fuzzy_anchor_errors = previous
+        self.assertEqual(key, LineMemo.key(words, "hanao"))
+        store = ReadingStore()
+        store.record("花", "か")
+        previous = utils.reading_store.reading_store
+        utils.reading_store.reading_store = store
+        try:
+            self.assertNotEqual(key, LineMemo.key(words, "hanao"))
+        finally:
+            utils.reading_store.reading_store = previous
+        self.assertEqual((False, None), memo.get(key))
+        memo.put(key, (-10, words))
+        found, res = memo.get(key)
+        self.assertTrue(found)
+        self.assertEqual((-10, words), res)
+        res[1][0].hiragana = "か"
+        self.assertEqual("はな", memo.get(key)[1][1][0].hiragana)
+        memo.put("a", None)
+        self.assertEqual((True, None), memo.get("a"))
+        memo.put("b", None)
+        self.assertEqual((False, None), memo.get(key))
+        self.assertEqual(2, len(memo))
+        self.assertEqual((3, 2), (memo.hits, memo.misses))
+        memo.put("c", GivenUp(100, "too long"))
+        self.assertEqual((True, GivenUp(100, "too long")), memo.get("c"))
+
+    def test_threads(self):
+        memo = LineMemo(50)
+
+        def work(offset: int):
+            for i in range(2000):
+                memo.put(str((i + offset) % 80), None)
+                memo.get(str((i * 7 + offset) % 80))
+
+        threads = [threading.Thread(target=work, args=(offset,)) for offset in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(50, len(memo))
+        self.assertEqual(8 * 2000, memo.hits + memo.misses)
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from utils.lyrics_similarity import get_signature, kanji_mismatch, estimate_jaccard, rank_candidates
+
+
+class Test(TestCase):
+    def test_signature(self):
+        signature = get_signature("{{photrans|夏空|なつぞら}}を鮮明に\n夏空")
+        self.assertEqual(6, signature.total)
+        self.assertEqual(2, signature.kanji["夏"])
+        self.assertEqual(2, signature.bigrams["夏空"])
+        self.assertEqual(1, signature.bigrams["空鮮"])
+
+    def test_rank_candidates(self):
+        expected = get_signature("夏空を鮮明に描いた")
+        candidates = [get_signature("冬空を鮮明に"), get_signature("夏空を鮮明に描いた"), get_signature("")]
+        self.assertEqual(["夏", "描"], kanji_mismatch(expected, candidates[0]))
+        self.assertEqual(1.0, estimate_jaccard(expected, candidates[1]))
+        self.assertLess(estimate_jaccard(expected, candidates[0]), 1.0)
+        self.assertEqual([(1, 1.0), (0, 0.6), (2, 0.0)], rank_candidates(expected, candidates))
+
+    def test_estimate_jaccard(self):
+        # 300 distinct bigrams each, 150 of them shared: the Jaccard similarity is 1/3
+        kanji = [chr(0x4E00 + i) for i in range(451)]
+        a = get_signature("".join(kanji[:301]))
+        b = get_signature("".join(kanji[150:451]))
+        self.assertAlmostEqual(1 / 3, estimate_jaccard(a, b), delta=0.15)
@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from models.conversion_log import ConversionLog
 from models.lyrics import Type, Word
-from web.mgp import replace_lyrics_jap, get_titles, filter_invalid_furigana
+from web.mgp import replace_lyrics_jap, replace_lyrics_lines, get_titles, filter_invalid_furigana
 
 
 class Test(TestCase):
@@ -18,8 +18,31 @@ class Test(TestCase):
                          replace_lyrics_jap(lyrics, words, ConversionLog()))
         lyrics = "自分より{{photrans|下手|へた}}くそな人{{ruby|别管我|べぐあんを}}あああ"
         words.append(Word("啊", Type.KANJI, hiragana="あ"))
+        logs = ConversionLog()
         self.assertEqual(expected,
-                         replace_lyrics_jap(lyrics, words, ConversionLog()))
+                         replace_lyrics_jap(lyrics, words, logs))
+        self.assertEqual(["下手", "别管我", "啊"], [w.surface for w in logs.unplaced_words])
+
+    def test_replace_lyrics_lines(self):
+        lyrics = "自分より\n下手くそな人\n知らない"
+        line_words = [[Word("自分", Type.KANJI, hiragana="じぶん"), Word("より", Type.KANA)],
+                      [Word("下手", Type.KANJI, hiragana="へた"), Word("人", Type.KANJI, hiragana="ひと")],
+                      None]
+        logs = ConversionLog()
+        self.assertEqual("{{photrans|自分|じぶん}}より\n{{photrans|下手|へた}}くそな{{photrans|人|ひと}}\n知らない",
+                         replace_lyrics_lines(lyrics, line_words, logs))
+        logs = ConversionLog()
+        line_words[1] = [Word("上手", Type.KANJI, hiragana="じょうず")]
+        self.assertEqual("{{photrans|自分|じぶん}}より\n下手くそな人\n知らない",
+                         replace_lyrics_lines(lyrics, line_words, logs))
+        self.assertEqual([(1, 2)], logs.unaligned_lines)
+        # words of lines left as they are are not recorded, and a repeated line is recorded once
+        self.assertEqual(["自分"], [w.surface for w in logs.final_words])
+        chorus = [Word("自分", Type.KANJI, hiragana="じぶん")]
+        logs = ConversionLog()
+        self.assertEqual("{{photrans|自分|じぶん}}\n{{photrans|自分|じぶん}}",
+                         replace_lyrics_lines("自分\n自分", [chorus, chorus], logs))
+        self.assertEqual(["自分"], [w.surface for w in logs.final_words])
 
     def test_get_titles(self):
         text = "|歌曲名称 = Test1 <br>{{lj|私}}  <br /> <span class=\"something\">{{lang|jap|Test2}}</span>\n|P主="
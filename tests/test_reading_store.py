@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+import utils.reading_store
+from models.lyrics import Word, Type
+from utils.reading_store import ReadingStore, apply_learned_readings
+
+
+class Test(TestCase):
+    def test_reading_store(self):
+        store = ReadingStore()
+        self.assertIsNone(store.confident_reading("心"))
+        for _ in range(2):
+            store.record("心", "こころ")
+        self.assertIsNone(store.confident_reading("心"))
+        store.record("心", "こころ")
+        self.assertEqual("こころ", store.confident_reading("心"))
+        store.record("心", "しん")
+        self.assertEqual([("こころ", 3), ("しん", 1)], store.readings("心"))
+        self.assertIsNone(store.confident_reading("心"))
+
+    def test_apply_learned_readings(self):
+        store = ReadingStore()
+        for _ in range(5):
+            store.record("本気", "マジ")
+        previous = utils.reading_store.reading_store
+        utils.reading_store.reading_store = store
+        try:
+            words = [Word("本気", Type.KANJI, hiragana="ほんき"), Word("で", Type.KANA)]
+            res = apply_learned_readings(words)
+            self.assertEqual(["マジ", ""], [w.hiragana for w in res])
+            self.assertEqual("ほんき", words[0].hiragana)
+            self.assertIs(words[1], res[1])
+        finally:
+            utils.reading_store.reading_store = previous
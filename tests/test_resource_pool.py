@@ -0,0 +1,56 @@
+import threading
+from unittest import TestCase
+
+from utils.resource_pool import ResourcePool
+
+
+class Test(TestCase):
+    def test_reuse(self):
+        pool = ResourcePool("test", object, 2)
+        with pool.acquire() as a:
+            with pool.acquire() as b:
+                self.assertIsNot(a, b)
+        with pool.acquire() as c:
+            self.assertIs(b, c)
+        self.assertEqual((2, 3, 0, 2), (pool.created, pool.acquisitions, pool.waits, pool.peak_in_use))
+        self.assertRaises(ValueError, ResourcePool, "test", object, 0)
+
+    def test_bounded(self):
+        pool = ResourcePool("test", object, 1)
+        first = pool.take()
+        got = []
+        thread = threading.Thread(target=lambda: got.append(pool.take()))
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual([], got)
+        pool.give_back(first)
+        thread.join(5)
+        self.assertEqual([first], got)
+        self.assertEqual((1, 1), (pool.created, pool.waits))
+
+    def test_thread_affinity(self):
+        pool = ResourcePool("test", object, 4)
+        used: list[set] = [set() for _ in range(4)]
+
+        def work(index: int):
+            for _ in range(20):
+                with pool.acquire() as resource:
+                    used[index].add(id(resource))
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(pool.created, 4)
+        self.assertEqual(80, pool.acquisitions)
+        # with as many resources as threads, no thread has to switch to another one
+        self.assertTrue(all(len(u) == 1 for u in used))
+
+    def test_failed_factory(self):
+        def fail():
+            raise RuntimeError()
+
+        pool = ResourcePool("test", fail, 1)
+        self.assertRaises(RuntimeError, pool.take)
+        self.assertEqual((0, 0), (pool.size, pool.in_use))
@@ -0,0 +1,35 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from utils.string_table import StringTable, write_string_table
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name).joinpath("table.bin")
+        write_string_table(self.path, [("人", ["ひと", "じん"]),
+                                       ("世界", ["せかい"]),
+                                       ("空", []),
+                                       ("人", ["にん", "じん"])])
+        self.table = StringTable(self.path)
+
+    def tearDown(self):
+        self.table.close()
+        self.dir.cleanup()
+
+    def test_get(self):
+        self.assertEqual(["ひと", "じん", "にん"], self.table.get("人"))
+        self.assertEqual(["せかい"], self.table.get("世界"))
+        self.assertEqual([], self.table.get("空"))
+        self.assertIsNone(self.table.get("世"))
+        self.assertNotIn("夏", self.table)
+        self.assertEqual(3, len(self.table))
+
+    def test_get_many(self):
+        self.assertEqual({"人": ["ひと", "じん", "にん"], "世界": ["せかい"]},
+                         self.table.get_many(["世界", "夏", "人", "人"]))
+
+    def test_version(self):
+        self.assertRaises(ValueError, lambda: StringTable(self.path, version=2))
@@ -61,3 +61,45 @@ Some more text here.
         print([[2, 12, 20, 29, 34], [2, 12, 23, 29, 34]],
               find_all_matches_in_string("yamanainoameganatsuzoraosemeiniegaitatte",
                                          ["manaino", "ga", "o", "ni", "itatte"]))
+
+    def test_scan_templates(self):
+        import wikitextparser as wtp
+        from utils.wikitext import title_equal
+        s = """{{VOCALOID_Songbox
+|image = a.jpg
+|演唱 = [[初音ミク|初音未来]]
+|其他资料 = 于{{color|red|x=1}}YouTube，再生数为21,392+
+|pos
+}}{{ vocaloid songbox }}{{Lyrics|{{VOCALOID Songbox|}}}}{{VOCALOID_Songbox"""
+        templates = scan_templates(s, "VOCALOID Songbox")
+        expected = [t for t in wtp.parse(s).templates if title_equal(t.name, "VOCALOID Songbox")]
+        self.assertEqual([(t.span[0], t.span[1]) for t in expected], [(t.start, t.end) for t in templates])
+        for t, e in zip(templates, expected):
+            self.assertEqual({a.name.strip(): a.value for a in e.arguments},
+                             {name: t.get_arg(name) for name in t.arguments})
+        self.assertIsNone(templates[0].get_arg("color"))
+        color = scan_templates(s, "color")[0]
+        self.assertTrue(templates[0].contains(color))
+        self.assertFalse(templates[1].contains(color))
+
+    def test_apply_patches(self):
+        s = "0123456789"
+        self.assertEqual("a12b3456789c", apply_patches(s, [(10, 10, "c"), (0, 1, "a"), (3, 3, "b")]))
+        self.assertEqual(s, apply_patches(s, []))
+        self.assertRaises(ValueError, apply_patches, s, [(0, 3, ""), (2, 4, "")])
+
+    def test_bracket_depth_map(self):
+        s = "a|{{b|{{c}}|d}}|e}}|f"
+        depth_map = BracketDepthMap(s)
+        self.assertEqual([0, 0, 1, 1, 1, 2, 1, 0, 0, -1], [depth_map.depth_at(i) for i in [0, 1, 4, 5, 6, 8, 12, 15, 16, 19]])
+        self.assertEqual(1, depth_map.find("|"))
+        self.assertEqual(15, depth_map.find("|", 2))
+        self.assertEqual(5, depth_map.find("|", 4))
+        self.assertEqual(-1, depth_map.find("f"))
+        self.assertEqual(2, depth_map.count("|"))
+        self.assertEqual(2, depth_map.count(lambda c: c in "ae"))
+        self.assertEqual(15, depth_map.closing(4))
+        self.assertEqual(19, depth_map.closing(0))
+        self.assertEqual(len(s), depth_map.closing(20))
+        self.assertIs(get_depth_map(s), get_depth_map(s))
+        self.assertEqual(2, count_symbol_not_in_bracket("漢{{photrans|漢|かん}}字", lambda c: c in "漢字"))
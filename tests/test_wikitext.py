@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import wikitextparser as wtp
+
+from utils.wikitext import ParsedPage, get_template_by_name, title_equal, ArgumentIndex
+
+
+class Test(TestCase):
+    def test_title_equal(self):
+        self.assertTrue(title_equal(" vocaloid_Songbox", "VOCALOID Songbox"))
+        self.assertFalse(title_equal("Lyrics", None))
+
+    def test_parsed_page(self):
+        text = "{{VOCALOID_Songbox|image=a.jpg|其他资料={{YoutubeCount|id=1}}}}\n" \
+               "{{Lyrics|original={{color|red|赤}}}}{{lyrics|original=青}}{{ vocaloid songbox }}"
+        page = ParsedPage(text)
+        self.assertEqual(text, str(page))
+        for name in ["VOCALOID_Songbox", "Lyrics", "color", "YoutubeCount", "cj"]:
+            self.assertEqual([t.string for t in get_template_by_name(wtp.parse(text), name)],
+                             [t.string for t in page.templates(name)])
+        first, second = page.templates("Lyrics")
+        self.assertEqual(["{{color|red|赤}}"], [t.string for t in page.templates_in(first, "color")])
+        self.assertEqual([], page.templates_in(second, "color"))
+        song_box = page.templates("vocaloid songbox")[0]
+        self.assertEqual(1, len(page.templates_in(song_box, "YoutubeCount")))
+        self.assertEqual([], page.templates_in(song_box, "VOCALOID_Songbox"))
+
+    def test_invalidate(self):
+        page = ParsedPage("{{Lyrics|original=a}}{{Lyrics|original=b}}")
+        first, second = page.templates("Lyrics")
+        first.string = "{{LyricsKai|original={{color|red|a}}}}"
+        page.invalidate()
+        self.assertEqual(1, len(page.templates("LyricsKai")))
+        self.assertEqual(1, len(page.templates_in(page.templates("LyricsKai")[0], "color")))
+        self.assertEqual([], page.templates_in(second, "color"))
+        self.assertEqual("{{LyricsKai|original={{color|red|a}}}}{{Lyrics|original=b}}", str(page))
+        page.discard_changes()
+        self.assertEqual("{{Lyrics|original=a}}{{Lyrics|original=b}}", str(page))
+        self.assertEqual(2, len(page.templates("Lyrics")))
+
+    def test_argument_index(self):
+        t = wtp.Template("{{Lyrics| lb-text1 =a|rb-text1=b|lb-text3=c|rb-text2=d|lb-text3=e|rb-text01=f|lang=ja}}")
+        arguments = ArgumentIndex(t)
+        self.assertIn("lang", arguments)
+        self.assertEqual("ja", arguments.value(" lang"))
+        self.assertIsNone(arguments.get("lb-color"))
+        self.assertEqual(t.get_arg("lb-text3").value, arguments.value("lb-text3"))
+        family = [(n, [None if a is None else a.value for a in args])
+                  for n, args in arguments.numbered("lb-text", "rb-text")]
+        self.assertEqual([(1, ["a", "b"]), (2, [None, "d"]), (3, ["e", None])], family)
+        self.assertEqual([], arguments.numbered("lb-color", "rb-color"))
@@ -0,0 +1,57 @@
+from collections import deque
+from typing import Iterable, Iterator
+
+
+class AhoCorasick:
+    """
+    Automaton that finds every occurrence of a set of patterns in a text in one pass over the text
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: list[str] = []
+        # transitions, failure link and indices of the patterns ending at each node
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[list[int]] = [[]]
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+
+    def add(self, pattern: str):
+        if len(pattern) == 0:
+            raise ValueError("Empty patterns match everywhere")
+        node = 0
+        for c in pattern:
+            if c not in self.goto[node]:
+                self.goto[node][c] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = self.goto[node][c]
+        self.output[node].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while len(queue) > 0:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback != 0 and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(c, 0)
+                self.output[child].extend(self.output[self.fail[child]])
+
+    def find_all(self, text: str) -> Iterator[tuple[int, int]]:
+        """
+        :param text: The text to look in
+        :return: The start of every occurrence and the index of the pattern that occurs there, ordered by end
+        """
+        node = 0
+        for index, c in enumerate(text):
+            while node != 0 and c not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            for pattern in self.output[node]:
+                yield index + 1 - len(self.patterns[pattern]), pattern
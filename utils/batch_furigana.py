@@ -0,0 +1,127 @@
+import gc
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Optional, Iterable, Iterator
+
+import config.config
+from models.conversion_log import ConversionLog
+from models.lyrics import Word, Type
+from utils.japanese_char import warm_up, preload_word_kana
+from utils.japanese_utils import remove_special_characters, prepare_line_words, match_line_words, \
+    collect_line_matches, WordListMismatch
+from utils.line_memo import get_line_memo
+from utils.logger import get_logger
+from utils.reading_store import apply_learned_readings
+
+# a line to match and its romaji
+LineTask = tuple[list[Word], str]
+
+
+@dataclass
+class Song:
+    name: str
+    jap: list[str]
+    romaji: list[str]
+    # identifies the song in Yahoo's cache; "0" bypasses the cache
+    page_id: str = "0"
+
+
+@dataclass
+class SongResult:
+    name: str
+    # words of each line, or None if the song could not be converted
+    lines: Optional[list[list[Word]]]
+    logs: ConversionLog = field(default_factory=ConversionLog)
+
+
+def init_worker():
+    """
+    Load the dictionaries once per worker process, then move everything loaded so far out of
+    the reach of the garbage collector so that its pages stay shared with the parent.
+    :return: None
+    """
+    warm_up()
+    get_line_memo()
+    gc.freeze()
+
+
+def match_chunk(tasks: list[LineTask]) -> list[tuple[Optional[list[Word]], Optional[str]]]:
+    """
+    Match consecutive lines of a song in a worker process
+    :param tasks: Words and romaji of each line
+    :return: Results of match_line_words for each line
+    """
+    preload_word_kana(w.surface for words, _ in tasks for w in words if w.type == Type.KANJI)
+    return [match_line_words(words, romaji) for words, romaji in tasks]
+
+
+def split_chunks(tasks: list[LineTask], chunk_lines: int) -> list[list[LineTask]]:
+    """
+    Songs of at most chunk_lines lines are matched in one piece; longer ones are split so
+    that a single long song is spread over several workers.
+    """
+    if len(tasks) <= chunk_lines:
+        return [tasks]
+    return [tasks[i:i + chunk_lines] for i in range(0, len(tasks), chunk_lines)]
+
+
+@dataclass
+class PendingSong:
+    song: Song
+    jap: list[str]
+    logs: ConversionLog
+    yahoo_words: Optional[list[list[Word]]] = None
+    line_words: list[list[Word]] = field(default_factory=list)
+    chunks: list[Future] = field(default_factory=list)
+
+    def result(self) -> SongResult:
+        if self.yahoo_words is None:
+            return SongResult(self.song.name, None, self.logs)
+        matches = (match for chunk in self.chunks for match in chunk.result())
+        lines = collect_line_matches(self.jap, self.song.romaji, self.yahoo_words, self.line_words,
+                                     matches, self.logs)
+        return SongResult(self.song.name, lines, self.logs)
+
+
+def convert_songs(songs: Iterable[Song], workers: Optional[int] = None,
+                  chunk_lines: Optional[int] = None) -> Iterator[SongResult]:
+    """
+    Add furigana to many songs, matching lines on a pool of processes.
+    Yahoo is queried in this process while workers match the lines of earlier songs.
+    :param songs: Japanese lyrics and romaji of each song
+    :param workers: Number of worker processes. Defaults to config.batch_workers, or the number of CPUs if that is 0.
+    :param chunk_lines: Most lines matched by a worker at once. Defaults to config.batch_chunk_lines.
+    :return: Results in the same order as songs, each yielded as soon as it and all songs before it are done
+    """
+    if workers is None:
+        workers = config.config.batch_workers or os.cpu_count() or 1
+    if chunk_lines is None:
+        chunk_lines = config.config.batch_chunk_lines
+    pending: deque[PendingSong] = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for song in songs:
+            jap = [remove_special_characters(line) for line in song.jap]
+            current = PendingSong(song, jap, ConversionLog())
+            try:
+                current.yahoo_words = prepare_line_words(jap, song.page_id)
+            except WordListMismatch as e:
+                # only this song fails; the rest of the batch goes on
+                get_logger().warning("Failed to split Yahoo's words for {}: {}".format(song.name, e))
+            if current.yahoo_words is not None:
+                current.line_words = [apply_learned_readings(words) for words in current.yahoo_words]
+                tasks = list(zip(current.line_words, song.romaji))
+                current.chunks = [executor.submit(match_chunk, chunk) for chunk in split_chunks(tasks, chunk_lines)]
+            pending.append(current)
+            # keep every worker busy without queueing up the whole batch
+            while len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def words_to_photrans(words: list[Word]) -> str:
+    return "".join(w.surface if w.type != Type.KANJI or len(w.hiragana) == 0
+                   else "{{{{photrans|{}|{}}}}}".format(w.surface, w.hiragana)
+                   for w in words)
@@ -0,0 +1,81 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+from models.conversion_log import ConversionLog, ConversionList
+from models.lyrics import Word
+from utils.caching import load_object, save_object
+from utils.line_alignment import line_signature
+
+CONVERSION_CACHE_VERSION = 2
+
+
+@dataclass
+class CachedConversion:
+    """
+    Everything the conversion of a page's lyrics produced before photrans templates were inserted,
+    with the conversions the operator removed already taken back
+    """
+    # words of each line of the lyrics, or None for lines without a counterpart
+    line_words: list[Optional[list[Word]]]
+    word_conversions: ConversionList = field(default_factory=list)
+    ignored_kanji: list[str] = field(default_factory=list)
+    budget_exceeded_lines: list[str] = field(default_factory=list)
+    unaligned_lines: list[tuple[int, int]] = field(default_factory=list)
+    removed_conversions: ConversionList = field(default_factory=list)
+    version: int = CONVERSION_CACHE_VERSION
+
+    @classmethod
+    def capture(cls, line_words: list[Optional[list[Word]]], logs: ConversionLog) -> "CachedConversion":
+        """
+        Take the conversion once invalid furigana were filtered, so that conversions removed then
+        are not brought up again when the conversion is reused
+        """
+        removed = list(logs.removed_conversions)
+        if len(removed) > 0:
+            # lines that share a counterpart keep sharing its list of words
+            restored: dict[int, list[Word]] = {}
+            for words in line_words:
+                if words is not None and id(words) not in restored:
+                    restored[id(words)] = [next((before for before, after in removed if w == after), w)
+                                           for w in words]
+            line_words = [None if words is None else restored[id(words)] for words in line_words]
+        word_conversions = [c for c in logs.word_conversions if c not in removed]
+        return cls(line_words, word_conversions, list(logs.ignored_kanji),
+                   list(logs.budget_exceeded_lines), list(logs.unaligned_lines), removed)
+
+    def restore(self, logs: ConversionLog):
+        """
+        Record the events of the cached conversion in logs as if the conversion had just happened
+        """
+        logs.word_conversions.extend(self.word_conversions)
+        logs.ignored_kanji = list(self.ignored_kanji)
+        logs.budget_exceeded_lines.extend(self.budget_exceeded_lines)
+        logs.unaligned_lines.extend(self.unaligned_lines)
+        logs.removed_conversions = list(self.removed_conversions)
+
+
+def lyrics_key(lyrics: str) -> str:
+    """
+    Hash lyrics so that copies differing only in spacing, punctuation, English text or existing
+    photrans templates share a key. Lines are kept apart, so line_words fits every lyrics with the key.
+    :param lyrics: Japanese lyrics
+    :return: A hex digest
+    """
+    normalised = "\n".join(line_signature(line) for line in lyrics.split("\n"))
+    return hashlib.sha1(normalised.encode("utf-8")).hexdigest()
+
+
+def conversion_cache_filename(key: str) -> str:
+    return "Conversion" + key + ".pickle"
+
+
+def load_conversion(key: str) -> Optional[CachedConversion]:
+    res = load_object(conversion_cache_filename(key))
+    if res is None or res.version != CONVERSION_CACHE_VERSION:
+        return None
+    return res
+
+
+def save_conversion(key: str, conversion: CachedConversion):
+    save_object(conversion_cache_filename(key), conversion)
@@ -0,0 +1,60 @@
+from typing import Iterable
+
+import numpy as np
+
+
+def substring_edit_distances(pattern: str, text: str, max_errors: int) -> np.ndarray:
+    """
+    Compute the edit distance between pattern and every substring of text that could be within
+    max_errors of it. All start positions are processed together, so the work is one pass over
+    pattern with array operations of size len(text) * (len(pattern) + max_errors).
+    :param pattern: The string to look for
+    :param text: The string to look in
+    :param max_errors: Maximum number of insertions, deletions and substitutions of interest
+    :return: An array d of shape (len(text) + 1, len(pattern) + max_errors + 1) such that d[s, l] is the
+    edit distance between pattern and text[s:s + l]. Substrings running past the end of text get max_errors + 1.
+    """
+    n = len(text)
+    width = len(pattern) + max_errors
+    # windows[s, l] is text[s + l], or -1 past the end of text
+    codes = np.full(n + width, -1, dtype=np.int64)
+    codes[:n] = [ord(c) for c in text]
+    windows = np.lib.stride_tricks.sliding_window_view(codes, width)[:n + 1] if width > 0 \
+        else np.empty((n + 1, 0), dtype=np.int64)
+    lengths = np.arange(width + 1)
+    # distances between pattern[:i] and text[s:s + l] for the current i, starting with the empty pattern
+    distances = np.broadcast_to(lengths, (n + 1, width + 1)).copy()
+    for i, c in enumerate(pattern, 1):
+        substitution = distances[:, :-1] + (windows != ord(c))
+        deletion = distances[:, 1:] + 1
+        current = np.empty_like(distances)
+        current[:, 0] = i
+        current[:, 1:] = np.minimum(substitution, deletion)
+        # insertions: d[i][l] = min over k <= l of d[i][k] + (l - k), resolved with a running minimum
+        distances = np.minimum.accumulate(current - lengths, axis=1) + lengths
+    past_end = np.arange(n + 1)[:, None] + lengths[None, :] > n
+    distances[past_end] = max_errors + 1
+    return distances
+
+
+def fuzzy_find(patterns: Iterable[str], text: str, max_errors: int) -> dict[int, dict[int, int]]:
+    """
+    Find every substring of text within max_errors edits of one of the patterns.
+    A pattern is never matched by a substring that differs from it in every character.
+    :param patterns: Strings to look for
+    :param text: The string to look in
+    :param max_errors: Maximum number of edits
+    :return: A dict from each start in text to a dict from each end to the fewest edits needed
+    """
+    result: dict[int, dict[int, int]] = {}
+    for pattern in patterns:
+        distances = substring_edit_distances(pattern, text, max_errors)
+        for start, length in zip(*np.nonzero(distances <= max_errors)):
+            errors = int(distances[start, length])
+            if errors > 0 and errors >= len(pattern):
+                continue
+            ends = result.setdefault(int(start), {})
+            end = int(start + length)
+            if end not in ends or errors < ends[end]:
+                ends[end] = errors
+    return result
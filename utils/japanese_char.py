@@ -1,53 +1,215 @@
+import functools
 import itertools
 import logging
 import re
-from typing import Optional
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import Optional, Callable, Iterable
 
-import jamdict
-import pykakasi
-from jamdict import Jamdict
-
-from models.two_way_dict import hiragana_dict, katakana_dict
+import config.config
+from models.two_way_dict import katakana_dict, hiragana_table, special_romaji
+from utils.caching import cache_path
+from utils.kana_transducer import KanaTransducer, SOKUON, CHOONPU
+from utils.lattice import Lattice
 from utils.logger import get_logger
+from utils.resource_pool import ResourcePool
+from utils.string_table import StringTable, write_string_table
+
+# jamdict and pykakasi are expensive to load and most modes never touch Japanese text,
+# so they are created on first use through the accessors below
+jam = None
+# pykakasi converters may not be used by two threads at once, so every thread borrows its own from this pool
+kakasi_pool: Optional[ResourcePool] = None
+# guards the creation of the pool and the dictionary tables
+resource_lock = threading.RLock()
+kanji_reading_table_path = cache_path.joinpath("kanjidic_readings.bin")
+KANJI_READING_TABLE_VERSION = 1
+kanji_reading_table: Optional[StringTable] = None
+word_kana_table_path = cache_path.joinpath("jmdict_word_kana.bin")
+WORD_KANA_TABLE_VERSION = 2
+word_kana_table: Optional[StringTable] = None
+word_kana_cache: dict[str, list[tuple[str, int]]] = {}
+# separates a kana reading from its priority in the word kana table
+PRIORITY_SEPARATOR = "\t"
+transducer = KanaTransducer(hiragana_table, katakana_dict, special_romaji)
+
+
+def get_jamdict():
+    global jam
+    with resource_lock:
+        if jam is None:
+            from jamdict import Jamdict
+            jam = Jamdict()
+    return jam
+
+
+def open_jamdict_connection() -> sqlite3.Connection:
+    """
+    Open the jamdict database read-only. The file is marked immutable so that SQLite skips locking.
+    Only the dictionary tables are built from it; lookups at runtime go through those tables.
+    :return: A connection for the calling thread
+    """
+    uri = Path(get_jamdict().db_file).as_uri() + "?mode=ro&immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+
+def create_kakasi():
+    import pykakasi
+    return pykakasi.Kakasi()
+
+
+def get_kakasi_pool() -> ResourcePool:
+    global kakasi_pool
+    with resource_lock:
+        if kakasi_pool is None:
+            kakasi_pool = ResourcePool("pykakasi", create_kakasi, config.config.kakasi_pool_size)
+    return kakasi_pool
+
+
+def kakasi_to_hiragana(s: str) -> str:
+    """
+    Guess the reading of a string with pykakasi
+    :param s: Japanese text
+    :return: The reading of s in hiragana
+    """
+    with get_kakasi_pool().acquire() as kks:
+        return "".join(part['hira'] for part in kks.convert(s))
+
+
+def warm_up():
+    """
+    Load everything the furigana pipeline needs up front so that the first page does not
+    pay for it. Dictionary tables are built if they do not exist yet.
+    :return: None
+    """
+    get_kanji_reading_table()
+    get_word_kana_table()
+    # create the first converter up front
+    with get_kakasi_pool().acquire():
+        pass
+
+
+def loaded_resources() -> list[str]:
+    """
+    :return: Names of the Japanese language resources that have been loaded so far
+    """
+    resources = [("Jamdict", jam), ("pykakasi", kakasi_pool),
+                 ("kanji reading table", kanji_reading_table), ("word kana table", word_kana_table)]
+    return [name for name, resource in resources if resource is not None]
+
+
+def pool_summaries() -> list[str]:
+    """
+    :return: Usage metrics of the pykakasi pool if it has been created
+    """
+    return [kakasi_pool.summary()] if kakasi_pool is not None else []
+
+
+# character classes are bit flags in a table with one byte per code point
+HIRAGANA = 1
+KATAKANA = 2
+KANJI = 4
+HALF_WIDTH = 8
+ENGLISH_PUNCTUATION = 16
+KANA = HIRAGANA | KATAKANA
+JAPANESE = KANA | KANJI | HALF_WIDTH
+class_ranges = [(HIRAGANA, 0x3041, 0x3096),
+                (KATAKANA, 0x30A0, 0x30FF),
+                (KANJI, 0x3400, 0x4DB5),
+                (KANJI, 0x4E00, 0x9FCB),
+                (KANJI, 0xF900, 0xFA6A),
+                (HALF_WIDTH, 0xFF5F, 0xFF9F)]
+
+
+def build_class_table() -> bytes:
+    # the table spans all planes so that str.translate never falls through;
+    # only the BMP has classes
+    table = bytearray(0x110000)
+    for flag, start, end in class_ranges:
+        table[start:end + 1] = bytes([flag]) * (end - start + 1)
+    # FIXME: is this the right place to deal with the dot?
+    table[ord('・')] = 0
+    table[ord('々')] = KANJI
+    for c in ",./'?":
+        table[ord(c)] = ENGLISH_PUNCTUATION
+    return bytes(table)
+
+
+class_table = build_class_table()
+run_pattern = re.compile(b"\x01+")
+
+
+def has_class(c: str, flags: int) -> bool:
+    return len(c) == 1 and class_table[ord(c)] & flags != 0
+
+
+def classify(s: str) -> bytes:
+    """
+    Classify every character of a string in one pass
+    :param s: A string
+    :return: One byte of class flags per character of s
+    """
+    return s.translate(class_table).encode("latin-1")
+
+
+@functools.lru_cache(maxsize=None)
+def get_mask_table(flags: int) -> bytes:
+    return bytes(1 if i & flags else 0 for i in range(256))
+
+
+def mask(s: str, flags: int) -> bytes:
+    """
+    :return: One byte per character of s that is 1 if the character belongs to one of flags and 0 otherwise
+    """
+    return classify(s).translate(get_mask_table(flags))
+
+
+def count_class(s: str, flags: int) -> int:
+    return mask(s, flags).count(1)
+
+
+def contains_class(s: str, flags: int) -> bool:
+    return 1 in mask(s, flags)
+
 
-jam = Jamdict()
-cursor = jam.kd2.ctx()
-kks = pykakasi.Kakasi()
-hiragana_pattern = re.compile("[\u3041-\u3096]")
-katakana_pattern = re.compile("[\u30A0-\u30FF]")
-kanji_pattern = re.compile("[\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A]")
-punctuation_pattern = re.compile("[\uFF5F-\uFF9F]")
+def find_class_spans(s: str, flags: int) -> list[tuple[int, int]]:
+    """
+    Find maximal runs of characters belonging to the given classes
+    :param s: A string
+    :param flags: Character classes
+    :return: A list of (start, end) pairs
+    """
+    return [m.span() for m in run_pattern.finditer(mask(s, flags))]
 
 
 def is_hiragana(c: str) -> bool:
-    return not not hiragana_pattern.fullmatch(c)
+    return has_class(c, HIRAGANA)
 
 
 def is_katakana(c: str) -> bool:
-    # FIXME: is this the right place to deal with the dot?
-    return katakana_pattern.fullmatch(c) is not None and c != '・'
+    return has_class(c, KATAKANA)
 
 
 def is_kana(c: str) -> bool:
-    return is_hiragana(c) or is_katakana(c)
+    return has_class(c, KANA)
 
 
 def is_kanji(c: str) -> bool:
-    return c == "々" or not not kanji_pattern.fullmatch(c)
+    return has_class(c, KANJI)
 
 
 def is_punctuation_or_half_width_katakana(c: str) -> bool:
-    return not not punctuation_pattern.fullmatch(c)
+    return has_class(c, HALF_WIDTH)
 
 
 def is_english_punctuation(c: str) -> bool:
-    return re.fullmatch("[,./'?]", c) is not None
+    return has_class(c, ENGLISH_PUNCTUATION)
 
 
 def is_japanese(c: str) -> bool:
-    return any([is_kana(c),
-                is_kanji(c),
-                is_punctuation_or_half_width_katakana(c)])
+    return has_class(c, JAPANESE)
 
 
 def process_pronunciation(s: str) -> str:
@@ -60,123 +222,283 @@ def process_pronunciation(s: str) -> str:
     return s
 
 
+def build_kanji_reading_table(path: Path = kanji_reading_table_path):
+    """
+    Compile the on and kun readings of every character in KANJIDIC into a string table.
+    Readings are cleaned up with process_pronunciation and converted to hiragana here
+    so that lookups never need SQL or pykakasi.
+    :param path: Where the table is written to
+    :return: None
+    """
+    # reading has no index on gid, so scan it once instead of joining per character
+    with closing(open_jamdict_connection()) as connection:
+        characters = connection.execute("SELECT c.literal, MIN(g.ID) FROM character c "
+                                        "LEFT JOIN rm_group g ON g.cid = c.ID GROUP BY c.ID ORDER BY c.ID").fetchall()
+        readings_rows = connection.execute("SELECT gid, value FROM reading "
+                                           "WHERE r_type='ja_on' OR r_type='ja_kun'").fetchall()
+    group_readings: dict[int, list[str]] = {}
+    for gid, value in readings_rows:
+        group_readings.setdefault(gid, []).append(kakasi_to_hiragana(process_pronunciation(value)))
+    readings: dict[str, list[str]] = {}
+    for literal, gid in characters:
+        readings.setdefault(literal, []).extend(group_readings.get(gid, []))
+    write_string_table(path, readings.items(), version=KANJI_READING_TABLE_VERSION)
+    get_logger().info("Kanji reading table with {} characters written to {}".format(len(readings), path))
+
+
+def priority_score(tags: Optional[str]) -> int:
+    """
+    Score JMdict priority tags. news1, ichi1, spec1 and gai1 mark the most common words,
+    the corresponding 2 tags less common ones, and nf01 to nf48 rank words by newspaper frequency.
+    :param tags: Comma separated priority tags, or None
+    :return: A score that is higher for more common words
+    """
+    if not tags:
+        return 0
+    score = 0
+    for tag in tags.split(","):
+        if tag.startswith("nf"):
+            score += 49 - int(tag[2:])
+        elif tag.endswith("1"):
+            score += 50
+        else:
+            score += 20
+    return score
+
+
+def build_word_kana_table(path: Path = word_kana_table_path):
+    """
+    Extract a surface to kana index from JMdict. Every written form of an entry maps
+    to all kana readings of that entry, which is what jam.lookup(s) used to provide.
+    Readings are stored with the priority of the written form and the reading, most common first.
+    :param path: Where the table is written to
+    :return: None
+    """
+    with closing(open_jamdict_connection()) as connection:
+        rows = connection.execute(
+            "SELECT k.text, n.text, (SELECT GROUP_CONCAT(text) FROM KJP WHERE kid = k.ID), "
+            "(SELECT GROUP_CONCAT(text) FROM KNP WHERE kid = n.ID) FROM Kanji k "
+            "JOIN Kana n ON n.idseq = k.idseq ORDER BY k.ID, n.ID").fetchall()
+    words: dict[str, dict[str, int]] = {}
+    for surface, kana, kanji_tags, kana_tags in rows:
+        readings = words.setdefault(surface, {})
+        score = priority_score(kanji_tags) + priority_score(kana_tags)
+        readings[kana] = max(score, readings.get(kana, 0))
+    items = ((surface, ["{}{}{}".format(kana, PRIORITY_SEPARATOR, score)
+                        for kana, score in sorted(readings.items(), key=lambda p: p[1], reverse=True)])
+             for surface, readings in words.items())
+    write_string_table(path, items, version=WORD_KANA_TABLE_VERSION)
+    get_logger().info("Word kana table with {} words written to {}".format(len(words), path))
+
+
+def load_string_table(path: Path, version: int, build: Callable[[Path], None]) -> StringTable:
+    if not path.exists():
+        build(path)
+    try:
+        return StringTable(path, version=version)
+    except ValueError:
+        build(path)
+        return StringTable(path, version=version)
+
+
+def get_kanji_reading_table() -> StringTable:
+    global kanji_reading_table
+    with resource_lock:
+        if kanji_reading_table is None:
+            kanji_reading_table = load_string_table(kanji_reading_table_path, KANJI_READING_TABLE_VERSION,
+                                                    build_kanji_reading_table)
+    return kanji_reading_table
+
+
+def get_word_kana_table() -> StringTable:
+    global word_kana_table
+    with resource_lock:
+        if word_kana_table is None:
+            word_kana_table = load_string_table(word_kana_table_path, WORD_KANA_TABLE_VERSION,
+                                                build_word_kana_table)
+    return word_kana_table
+
+
+def get_kanji_readings(c: str) -> Optional[list[str]]:
+    """
+    Look up the readings of a single character in KANJIDIC
+    :param c: A character
+    :return: Readings in hiragana, or None if c is not in KANJIDIC.
+    """
+    return get_kanji_reading_table().get(c)
+
+
+def preload_word_kana(surfaces: Iterable[str]):
+    """
+    Resolve the kana of all words of a song with one sweep over the word kana table.
+    The result replaces the previous preload and is consulted by get_word_kana.
+    :param surfaces: Surfaces of the words
+    :return: None
+    """
+    global word_kana_cache
+    surfaces = set(surfaces)
+    found = get_word_kana_table().get_many(surfaces)
+    word_kana_cache = {s: parse_word_kana(found.get(s, [])) for s in surfaces}
+
+
+def parse_word_kana(values: list[str]) -> list[tuple[str, int]]:
+    result = []
+    for v in values:
+        kana, score = v.split(PRIORITY_SEPARATOR)
+        result.append((kana, int(score)))
+    return result
+
+
+def get_word_kana_priorities(s: str) -> list[tuple[str, int]]:
+    """
+    Look up the kana readings JMdict lists for a word with their priorities
+    :param s: Surface of the word
+    :return: Pairs of reading and priority score, most common first
+    """
+    # preload_word_kana may replace the cache in another thread at any moment
+    cache = word_kana_cache
+    hit = cache.get(s)
+    if hit is not None:
+        return hit
+    res = get_word_kana_table().get(s)
+    return [] if res is None else parse_word_kana(res)
+
+
+def get_word_kana(s: str) -> list[str]:
+    """
+    Look up the kana readings JMdict lists for a word
+    :param s: Surface of the word
+    :return: All kana readings of the entries written as s, most common first
+    """
+    return [kana for kana, _ in get_word_kana_priorities(s)]
+
+
 def get_pronunciations(s: str) -> list[str]:
     possibilities = []
     for c in s:
-        res = cursor.select("SELECT ID FROM character WHERE literal='{}'".format(c))
-        if len(res) == 0:
+        text = get_kanji_readings(c)
+        if text is None:
             possibilities = []
             break
-        char_id = res[0][0]
-        res = cursor.select("SELECT ID FROM rm_group WHERE cid={}".format(char_id))
-        rm_group_id = res[0][0]
-        res = cursor.select("SELECT value FROM reading WHERE gid={} "
-                            "AND (r_type='ja_on' OR r_type='ja_kun')".format(rm_group_id))
-        text = ["".join([i['hira'] for i in kks.convert(process_pronunciation(r[0]))])
-                for r in res]
         possibilities.append(text)
     result: list[str] = []
     for prod in itertools.product(*possibilities):
         result.append("".join(prod))
-    res = jam.lookup(s).to_dict()
-    for entry in res['entries']:
-        for kana in entry['kana']:
-            result.append(kana['text'])
+    result.extend(get_word_kana(s))
     # FIXME: should contain more possibilities such as names
     return list(set(result))
 
 
-vowels = ['a', 'e', 'i', 'o', 'u']
+# the first kana of a reading may be voiced inside a compound: 人々 -> ひとびと
+rendaku: dict[str, list[str]] = {k: [v] for k, v in zip("かきくけこさしすせそたちつてとはひふへほ",
+                                                          "がぎぐげござじずぜぞだぢづでどばびぶべぼ")}
+for k, v in zip("はひふへほ", "ぱぴぷぺぽ"):
+    rendaku[k].append(v)
+# the last kana of a reading may become っ before the next character: 一回 -> いっかい
+sokuon_endings = "つちくき"
+
+
+@functools.lru_cache(maxsize=4096)
+def get_pronunciation_lattice(s: str, variants: bool = False) -> Lattice:
+    """
+    Build a lattice of the possible readings of a word without enumerating them.
+    Node i sits before the i-th character; each character contributes its KANJIDIC readings
+    and every JMdict reading of the whole word is an edge from the first node to the last.
+    :param s: Surface of the word
+    :param variants: Whether to add rendaku and sokuon forms of the character readings
+    :return: A lattice whose accepts method checks a reading in time proportional to its length
+    """
+    lattice = Lattice(len(s))
+    per_char = [get_kanji_readings(c) for c in s]
+    if all(readings is not None for readings in per_char):
+        for index, readings in enumerate(per_char):
+            for reading in readings:
+                if not reading:
+                    continue
+                lattice.add(index, index + 1, reading)
+                if not variants:
+                    continue
+                if index > 0:
+                    for voiced in rendaku.get(reading[0], []):
+                        lattice.add(index, index + 1, voiced + reading[1:])
+                if index < len(s) - 1 and reading[-1] in sokuon_endings and len(reading) > 1:
+                    lattice.add(index, index + 1, reading[:-1] + 'っ')
+    if len(s) > 0:
+        for kana in get_word_kana(s):
+            lattice.add(0, len(s), kana)
+    return lattice
+
+
+def is_valid_reading(s: str, hiragana: Optional[str], variants: bool = False) -> bool:
+    """
+    Check whether hiragana is a plausible reading of s
+    :param s: Surface of the word
+    :param hiragana: The reading to check
+    :param variants: Whether rendaku and sokuon forms of the character readings count as plausible
+    :return: True if the pronunciation lattice of s accepts hiragana
+    """
+    return hiragana is not None and get_pronunciation_lattice(s, variants).accepts(hiragana)
 
 
 def romaji_to_hiragana(romaji: str, report_error: bool = False) -> Optional[str]:
-    try:
-        curr = ""
-        result = []
-        for i in range(len(romaji)):
-            if romaji[i] in vowels:
-                curr += romaji[i]
-                if curr[0] == 'n' and curr not in hiragana_dict:
-                    result.append('ん')
-                    curr = curr[1:]
-                if len(curr) == 3 and curr[0] == curr[1]:
-                    result.append("っ")
-                    curr = curr[1:]
-                # doo -> どう
-                if romaji[i] == 'o' and i > 0 and romaji[i-1] == 'o':
-                    result.append("う")
-                else:
-                    result.append(hiragana_dict.get(curr))
-                curr = ""
-            else:
-                curr += romaji[i]
-        if len(curr) > 0:
-            result.append(hiragana_dict[curr])
-        return "".join(result)
-    except Exception as e:
-        if report_error:
-            get_logger().error("Cannot convert " + romaji + " to hiragana.")
-        return None
+    result = transducer.to_hiragana(romaji)
+    if result is None and report_error:
+        get_logger().error("Cannot convert " + romaji + " to hiragana.")
+    return result
 
 
 def char_to_romaji(kana: str) -> list[str]:
-    special = {
-        'へ': ['he', 'e'],
-        'ヲ': ['wo', 'o'],
-        'を': ['wo', 'o'],
-        'は': ['ha', 'wa'],
-        'ふ': ['fu', 'hu'],
-        'フ': ['fu', 'hu'],
-        'づ': ['zu'],
-        'ぢ': ['ji'],
-        'ぁ': ['a'],
-        'ぃ': ['i'],
-        'ぅ': ['u'],
-        'ぇ': ['e'],
-        'ぉ': ['o'],
-        'ァ': ['a'],
-        'ィ': ['i'],
-        'ゥ': ['u'],
-        'ェ': ['e'],
-        'ォ': ['o']
-    }
-    if kana in special:
-        return special[kana]
-    if kana in hiragana_dict:
-        return [hiragana_dict[kana]]
-    if kana in katakana_dict:
-        return [katakana_dict[kana]]
+    options = transducer.romaji_options(kana)
+    if options is not None:
+        return options
     get_logger().warning("Failed to convert " + kana + " to romaji.")
     return [kana]
 
 
-def kana_to_romaji(kana_original: str) -> list[str]:
+def kana_to_romaji_units(kana: str) -> list[list[str]]:
+    """
+    Transliterate kana unit by unit
+    :param kana: Kana to transliterate
+    :return: Accepted romaji of each unit, in order
+    """
     # FIXME: だっ -> da? where ? is the wildcard character
     # FIXME: 一致(いっち) is transcribed as itchi
-    def recursive_to_romaji(kana: str) -> list[list[str]]:
-        if len(kana) == 0:
-            return []
-        if 'っ' in kana or 'ッ' in kana:
-            index = max(kana.find('っ'), kana.find('ッ'))
-            before = recursive_to_romaji(kana[:index])
-            after = recursive_to_romaji(kana[index + 1:])
-            options = ['h', '']
-            if len(after) > 0:
-                options.append(after[0][0][0])
-            if len(before) > 0:
-                options.append(before[-1][0][-1])
-            return before + [options] + after
-        if 'ー' in kana:
-            index = kana.find("ー")
-            front = recursive_to_romaji(kana[:index])
-            back = recursive_to_romaji(kana[index + 1:])
+    units = transducer.split_units(kana)
+    result: list[list[str]] = []
+    for index, unit in enumerate(units):
+        if unit in SOKUON:
+            result.append(['h', ''])
+        elif unit == CHOONPU:
             # FIXME: use wildcard
-            pronunciation = front[-1][0][-1] if len(front) > 0 else ""
-            return front + [[pronunciation, '']] + back
-        if len(kana) >= 2 and kana[:2] in hiragana_dict or kana[:2] in katakana_dict:
-            return [char_to_romaji(kana[:2])] + recursive_to_romaji(kana[2:])
-        return [char_to_romaji(kana[0])] + recursive_to_romaji(kana[1:])
-
-    res = recursive_to_romaji(kana_original)
-    return list(set(["".join(elem)
-                     for elem in itertools.product(*res)]))
+            prev = units[index - 1] if index > 0 else None
+            pronunciation = result[-1][0][-1] if prev is not None and prev not in SOKUON and prev != CHOONPU else ""
+            result.append([pronunciation, ''])
+        else:
+            result.append(char_to_romaji(unit))
+    # っ doubles the consonant after it or repeats the sound before it
+    for index, unit in enumerate(units):
+        if unit not in SOKUON:
+            continue
+        if index + 1 < len(result) and len(result[index + 1][0]) > 0:
+            result[index].append(result[index + 1][0][0])
+        if index > 0 and len(result[index - 1][0]) > 0:
+            result[index].append(result[index - 1][0][-1])
+    return result
+
+
+def kana_to_romaji_lattice(kana: str) -> Lattice:
+    """
+    Transliterate kana without enumerating every combination of alternatives
+    :param kana: Kana to transliterate
+    :return: A lattice accepting every romaji of kana
+    """
+    return Lattice.from_units(kana_to_romaji_units(kana))
+
+
+def kana_to_romaji(kana_original: str) -> list[str]:
+    return list(kana_to_romaji_lattice(kana_original).variants())
+
+
+if __name__ == "__main__":
+    build_kanji_reading_table()
+    build_word_kana_table()
@@ -1,21 +1,24 @@
-import functools
-import itertools
-from typing import Optional, Union
+from typing import Optional, Union, Iterable
 
 import config.config
 from web import yahoo
 from models.conversion_log import ConversionLog, ConversionList
 from models.lyrics import Word, Type
-from utils.string_utils import find_all_matches_in_string, is_empty, count_symbol_not_in_bracket
+from utils.string_utils import count_symbol_not_in_bracket
 from utils.input_utils import prompt_choices
-from utils.japanese_char import is_kana, is_kanji, is_japanese, get_pronunciations, romaji_to_hiragana, kana_to_romaji
+from utils.japanese_char import is_kanji, is_valid_reading, romaji_to_hiragana, kana_to_romaji, \
+    kana_to_romaji_lattice, get_word_kana_priorities, preload_word_kana, contains_class, count_class, mask, \
+    KANA, KANJI, JAPANESE, transducer
+from utils.line_memo import LineMemo, GivenUp, get_line_memo
 from utils.logger import get_logger
+from utils.lyrics_similarity import LyricsSignature, get_signature, kanji_mismatch
+from utils.lattice import Lattice
+from utils.reading_store import apply_learned_readings, get_reading_store
 
 
 def is_japanese_lyrics(lyrics: str) -> bool:
     # there must exist at least 1 kana character and at least 1 kanji character
-    return any([is_kana(c) for c in lyrics]) and \
-           any([is_kanji(c) for c in lyrics])
+    return contains_class(lyrics, KANA) and contains_class(lyrics, KANJI)
 
 
 def is_fully_translated(lyrics: str) -> bool:
@@ -25,7 +28,7 @@ def is_fully_translated(lyrics: str) -> bool:
     :return: True if translated. False otherwise.
     """
     # count number of kanji
-    kanji_count = len([c for c in lyrics if is_kanji(c)])
+    kanji_count = count_class(lyrics, KANJI)
     # count number of kanji not in a template
     no_furigana_count = count_symbol_not_in_bracket(lyrics, is_kanji)
     return kanji_count == 0 or no_furigana_count / kanji_count < 0.5
@@ -48,8 +51,7 @@ def furigana_local(lyrics: str) -> str:
             close_index = line.find(symbol, index + 1)
             furigana = line[index + 1:close_index]
             if close_index == -1 or index + 1 == close_index or \
-                    not functools.reduce(lambda a, b: a and b,
-                                         [is_kana(c) for c in furigana]):
+                    count_class(furigana, KANA) != len(furigana):
                 continue
             kanji_start = index - 1
             while kanji_start >= 0 and is_kanji(line[kanji_start]):
@@ -66,18 +68,22 @@ def furigana_local(lyrics: str) -> str:
 
 
 def lyrics_match(l1: str, l2: str, logs: ConversionLog) -> bool:
-    total = 0
-    mismatch = 0
-    mismatch_list = []
-    for c in l1:
-        if is_kanji(c):
-            total += 1
-            if c not in l2:
-                mismatch += 1
-                mismatch_list.append(c)
-    if mismatch == 0:
+    return signatures_match(get_signature(l1), get_signature(l2), logs)
+
+
+def signatures_match(expected: LyricsSignature, candidate: LyricsSignature, logs: ConversionLog) -> bool:
+    """
+    Check whether candidate lyrics contain the kanji of the expected lyrics, asking whether
+    to ignore them if only a few are missing
+    :param expected: Signature of the expected lyrics
+    :param candidate: Signature of the candidate lyrics
+    :param logs: Missing kanji are recorded in logs.ignored_kanji if they are ignored
+    :return: True if the lyrics match
+    """
+    mismatch_list = kanji_mismatch(expected, candidate)
+    if len(mismatch_list) == 0:
         return True
-    if mismatch / total < 0.1:
+    if len(mismatch_list) / expected.total < 0.1:
         get_logger().warning("Mismatches between Japanese lyrics: " + str(mismatch_list))
         if config.config.ignore_minor_diff:
             res = prompt_choices("Ignore minor difference? ", ['Yes', 'No'])
@@ -93,34 +99,55 @@ def join_kana(kana: list[Word]) -> Word:
     return Word(surface=s, type=Type.KANA, hiragana=s)
 
 
-def jap_line_to_words(jap: str, existing: list[Word]) -> list[Word]:
+class WordListMismatch(AssertionError):
     """
-    Convert a line of Japanese lyrics to a list of conversions
+    Raised when the words given by Yahoo do not spell a line of lyrics
+    """
+
+    def __init__(self, line_index: int, column: int, line: str, expected: str):
+        super().__init__("Word list does not match line {} at column {}: expected {} but found {}".format(
+            line_index + 1, column + 1, expected, line[column:column + len(expected)]))
+        self.line_index = line_index
+        self.column = column
+
+
+def line_words_from(jap: str, existing: list[Word], start: int = 0, line_index: int = 0) -> tuple[list[Word], int]:
+    """
+    Convert a line of Japanese lyrics to a list of conversions, reading Yahoo's words from a cursor
     :param jap: Original japanese without special characters
-    :param existing: Existing list of conversions provided by Yahoo's furigana tool
-    :return: List of conversions including English ones
+    :param existing: Words given by Yahoo for the whole song. The list is not modified.
+    :param start: Index in existing of the first word of this line
+    :param line_index: Index of the line in the song, used in error messages
+    :return: List of conversions including English ones, and the index in existing of the first word of the next line
+    :raise WordListMismatch: if the words do not spell jap
     """
     index = 0
     words = []
+    cursor = start
     jap = "".join([c for c in jap if c != ' ' and c != '　' and c != ''])
-    while index < len(jap):
-        if len(existing) == 0:
-            break
-        if existing[0].surface not in jap[index:]:
+    japanese = mask(jap, JAPANESE)
+    while index < len(jap) and cursor < len(existing):
+        surface = existing[cursor].surface
+        if jap.startswith(surface, index):
+            words.append(existing[cursor])
+            cursor += 1
+            index += len(surface)
+            continue
+        location = jap.find(surface, index)
+        if location == -1:
+            # the word belongs to a later line, so the rest of this line is not Japanese
             rest = jap[index:]
             if is_japanese_lyrics(rest):
-                raise AssertionError("Word list dose not match jap")
+                raise WordListMismatch(line_index, index, jap, surface)
             words.append(Word(rest, type=Type.ENGLISH))
-            break
-        location = jap.find(existing[0].surface, index)
-        if location == index:
-            words.append(existing.pop(0))
-            index += len(words[-1].surface)
+            index = len(jap)
+        elif japanese[index]:
+            raise WordListMismatch(line_index, index, jap, surface)
         else:
-            start = index
-            while index < len(jap) and not is_japanese(jap[index]):
+            begin = index
+            while index < len(jap) and not japanese[index]:
                 index += 1
-            words.append(Word(surface=jap[start:index], type=Type.ENGLISH))
+            words.append(Word(surface=jap[begin:index], type=Type.ENGLISH))
     # merge kana such as っ and て together
     prev = list()
     result = []
@@ -134,70 +161,245 @@ def jap_line_to_words(jap: str, existing: list[Word]) -> list[Word]:
             result.append(word)
     if len(prev) > 0:
         result.append(join_kana(prev))
+    return result, cursor
+
+
+def jap_line_to_words(jap: str, existing: list[Word]) -> list[Word]:
+    """
+    Convert a line of Japanese lyrics to a list of conversions
+    :param jap: Original japanese without special characters
+    :param existing: Existing list of conversions provided by Yahoo's furigana tool. Words of this line are removed.
+    :return: List of conversions including English ones
+    """
+    result, cursor = line_words_from(jap, existing)
+    del existing[:cursor]
+    return result
+
+
+def align_yahoo_words(jap: list[str], existing: list[Word]) -> list[list[Word]]:
+    """
+    Split the words Yahoo gives for a whole song into lines in one pass
+    :param jap: Lines of Japanese lyrics without special characters
+    :param existing: Words given by Yahoo for all lines. The list is not modified.
+    :return: A list parallel with jap holding the conversions of each line
+    :raise WordListMismatch: if the words do not spell the lyrics
+    """
+    result = []
+    cursor = 0
+    for line_index, line in enumerate(jap):
+        words, cursor = line_words_from(line, existing, cursor, line_index)
+        result.append(words)
     return result
 
 
-def match_non_kana_with_romaji(word_list: list[Word], romaji: str) -> (int, list[Word]):
+MATCHING_KANA = -10
+NON_MATCHING_KANA = -100
+INVALID_RATING_CHANGE = -1000
+# score of every confirmation of a reading in rank_readings
+CONFIRMED_READING_SCORE = 100
+# rating change for every typo in the romaji of a kana word
+FUZZY_ANCHOR_ERROR = -100
+
+
+class SearchBudgetExceeded(Exception):
+    """
+    Raised when aligning a line takes more work than config.line_search_budget allows
+    """
+    pass
+
+
+class SearchBudget:
+    """
+    Work units that may be spent on aligning a line. Every pass over the line, including the
+    matching of the words between kana, spends from the same budget.
+    """
+
+    def __init__(self, limit: Optional[int], romaji: str):
+        self.limit = limit
+        self.romaji = romaji
+        self.work = 0
+
+    def spend(self, units: int):
+        self.work += units
+        if self.limit is not None and self.work > self.limit:
+            raise SearchBudgetExceeded("Aligning {} took more than {} work units".format(self.romaji, self.limit))
+
+
+def match_non_kana_with_romaji(word_list: list[Word], romaji: str,
+                               budget: Optional[SearchBudget] = None) -> (int, list[Word]):
     """
     Try to match non-kana characters (english conversions and kanji) with their corresponding romaji.
     :param word_list: List of conversions that are of Type ENGLISH and KANJI
     :param romaji: Corresponding romaji
+    :param budget: If given, every segment and state evaluated is charged to it
     :return: A tuple consisting a number that represents the rating of this matching and the
     resulting list of conversions. The higher the rating, the higher the chance that this matching
     is correct.
+    :raise SearchBudgetExceeded: if budget runs out
     """
-    MATCHING_KANA = -10
-    NON_MATCHING_KANA = -100
-    INVALID_RATING_CHANGE = -1000
+    res = rank_non_kana_matches(word_list, romaji, 1, budget)
+    if len(res) == 0:
+        return None
+    return res[0]
+
+
+def rank_non_kana_matches(word_list: list[Word], romaji: str, k: int,
+                          budget: Optional[SearchBudget] = None) -> list[tuple[int, list[Word]]]:
+    """
+    Find the k best ways to split romaji among non-kana words. Ratings follow match_non_kana_with_romaji.
+    States are pairs of word index and romaji offset and each keeps its k best completions,
+    so the cost is polynomial in the length of romaji instead of exponential in the number of words.
+    :param word_list: List of conversions that are of Type ENGLISH and KANJI
+    :param romaji: Corresponding romaji
+    :param k: Maximum number of alternatives
+    :param budget: If given, every segment and state evaluated is charged to it
+    :return: Up to k pairs of rating and list of conversions, best first. Among equal ratings,
+    splits that give more romaji to earlier words come first.
+    :raise SearchBudgetExceeded: if budget runs out
+    """
+    if budget is None:
+        budget = SearchBudget(None, romaji)
     # for Kanji, try their supposed kana first
     # for English word, try the unmodified original first
     # if fail, use romaji and decrease rating
     if len(word_list) == 1:
+        budget.spend(1)
         elem = word_list[0]
+        # every kanji takes at least one romaji character, as in the split search below
+        if elem.type == Type.KANJI and len(romaji) < len(elem.surface):
+            return []
         if romaji in elem.romaji:
-            return 0, word_list
+            return [(0, word_list)]
         else:
             hiragana = romaji_to_hiragana(romaji, report_error=False)
             if hiragana is None:
                 rating = INVALID_RATING_CHANGE
-            elif hiragana in get_pronunciations(elem.surface):
+            elif is_valid_reading(elem.surface, hiragana, variants=True):
                 rating = MATCHING_KANA
             else:
                 rating = NON_MATCHING_KANA
-            return rating, [Word(elem.surface, type=elem.type, romaji=[romaji],
-                                 hiragana=hiragana)]
-
-    candidates: list[tuple[int, list[Word]]] = []
-
-    def match_recursive(words: list[Word], roma: str, current: tuple[int, list[Word]]):
-        if len(words) == 0:
-            if len(roma) > 0:
-                return
-            candidates.append(current)
-        if len(roma) == 0:
-            return
-        cur = words[0]
-        for r in cur.romaji:
-            if roma.find(r) == 0:
-                next_list = (current[0], list(current[1]))
-                next_list[1].append(cur)
-                return match_recursive(words[1:], roma[len(r):], next_list)
-        for index in range(len(cur.surface), len(roma) + 1):
-            # FIXME: if matching for English, relax requirements and just get the romaji in there
-            hiragana = romaji_to_hiragana(roma[:index])
-            if not hiragana:
+            return [(rating, [Word(elem.surface, type=elem.type, romaji=[romaji],
+                                   hiragana=hiragana)])]
+
+    length = len(romaji)
+    # hiragana of every convertible romaji[start:end], found in one pass per start
+    # prefixes stops as soon as romaji[start:end] can no longer be converted, e.g. at "natsuz"
+    segments: list[list[tuple[int, str]]] = [[(end, hiragana) for end, hiragana in transducer.prefixes(romaji, start)
+                                              if hiragana] for start in range(length + 1)]
+    budget.spend(sum(len(ends) for ends in segments) + length + 1)
+    # best[pos] holds, for the words after the current one, up to k (rating, ends, words) completions
+    # of romaji[pos:]; ends is the tuple of split points used to break ties
+    best: list[list[tuple[int, tuple[int, ...], list[Word]]]] = [[] for _ in range(length + 1)]
+    best[length] = [(0, (), [])]
+    for cur in reversed(word_list):
+        # the likely readings of the word are the same at every offset
+        readings = reading_candidates(cur.surface) if k == 1 and cur.type == Type.KANJI else []
+        current: list[list[tuple[int, tuple[int, ...], list[Word]]]] = [[] for _ in range(length + 1)]
+        for pos in range(length):
+            budget.spend(1)
+            # a known romanisation of the word is taken without considering anything else
+            known = next((r for r in cur.romaji if romaji.startswith(r, pos)), None)
+            if known is not None:
+                end = pos + len(known)
+                current[pos] = [(rating, (end,) + ends, [cur] + words)
+                                for rating, ends, words in best[end]]
                 continue
-            rating = MATCHING_KANA if hiragana in get_pronunciations(cur.surface) else NON_MATCHING_KANA
-            next_list = (current[0] + rating, list(current[1]))
-            next_list[1].append(Word(cur.surface, cur.type,
-                                     romaji=[roma[:index]], hiragana=hiragana))
-            match_recursive(words[1:], roma[index:], next_list)
-        return
-
-    match_recursive(word_list, romaji, (0, []))
-    if len(candidates) == 0:
-        return None
-    return sorted(candidates, key=lambda p: p[0])[-1]
+            # likely readings first: one that leaves a perfect completion for the remaining
+            # words cannot be beaten, so the split search is skipped
+            if len(readings) > 0:
+                probe = probe_readings(cur, readings, romaji, pos, best, budget)
+                if probe is not None:
+                    current[pos] = [probe]
+                    continue
+            options = []
+            budget.spend(len(segments[pos]))
+            for end, hiragana in segments[pos]:
+                # FIXME: if matching for English, relax requirements and just get the romaji in there
+                if end - pos < len(cur.surface) or len(best[end]) == 0:
+                    continue
+                rating = MATCHING_KANA if is_valid_reading(cur.surface, hiragana, variants=True) \
+                    else NON_MATCHING_KANA
+                word = Word(cur.surface, cur.type, romaji=[romaji[pos:end]], hiragana=hiragana)
+                options.extend((rating + r, (end,) + ends, [word] + words) for r, ends, words in best[end])
+            options.sort(key=lambda t: (t[0], t[1]), reverse=True)
+            current[pos] = options[:k]
+        best = current
+    return [(rating, words) for rating, _, words in best[0]]
+
+
+def rank_readings(surface: str) -> list[tuple[str, int]]:
+    """
+    Rank the readings of a word by how likely they are
+    :param surface: Surface of the word
+    :return: Pairs of reading and score, most likely first. A reading scores its JMdict priority
+    plus CONFIRMED_READING_SCORE for every time it was confirmed in an earlier edit.
+    """
+    scores: dict[str, int] = {}
+    for hiragana, priority in get_word_kana_priorities(surface):
+        scores[hiragana] = priority
+    for hiragana, count in get_reading_store().readings(surface):
+        scores[hiragana] = scores.get(hiragana, 0) + count * CONFIRMED_READING_SCORE
+    return sorted(scores.items(), key=lambda p: p[1], reverse=True)
+
+
+def reading_candidates(surface: str) -> list[tuple[str, list[str], int]]:
+    """
+    :param surface: Surface of a kanji word
+    :return: The readings of rank_readings in the same order, each with its romanisations and
+    the rating rank_non_kana_matches gives it
+    """
+    return [(hiragana, kana_to_romaji(hiragana),
+             MATCHING_KANA if is_valid_reading(surface, hiragana, variants=True) else NON_MATCHING_KANA)
+            for hiragana, _ in rank_readings(surface)]
+
+
+def probe_readings(word: Word, readings: list[tuple[str, list[str], int]], romaji: str, pos: int,
+                   completions: list[list[tuple[int, tuple[int, ...], list[Word]]]],
+                   budget: Optional[SearchBudget] = None) -> Optional[tuple[int, tuple[int, ...], list[Word]]]:
+    """
+    Try the likely readings of a kanji word at romaji[pos:] in order
+    :param word: A kanji word
+    :param readings: Result of reading_candidates for the word
+    :param romaji: Romaji of the words
+    :param pos: Where the romaji of word starts
+    :param completions: Best completions of the following words from each offset, as in rank_non_kana_matches
+    :param budget: If given, every romanisation tried is charged to it
+    :return: The first completion that is as good as any split could be, or None.
+    """
+    for hiragana, romanisations, reading_rating in readings:
+        # a reading rated as not matching can be beaten by some split, so only the full search decides
+        if reading_rating != MATCHING_KANA:
+            continue
+        for r in romanisations:
+            if budget is not None:
+                budget.spend(1)
+            end = pos + len(r)
+            if len(r) == 0 or not romaji.startswith(r, pos) or len(completions[end]) == 0:
+                continue
+            rating, ends, words = completions[end][0]
+            if rating == 0:
+                return (reading_rating, (end,) + ends,
+                        [Word(word.surface, word.type, romaji=[r], hiragana=hiragana)] + words)
+    return None
+
+
+def probe_line(jap: list[Word], romaji: str) -> bool:
+    """
+    Check whether the romaji of a line is exactly what its words already spell, in which case
+    matching cannot improve on the words as they are
+    :param jap: Words of the line with their romaji filled in
+    :param romaji: Romaji of the line
+    :return: True if the words spell romaji
+    """
+    lattice = Lattice(len(jap))
+    for index, word in enumerate(jap):
+        for r in word.romaji:
+            lattice.add(index, index + 1, r)
+    return lattice.accepts(romaji)
+
+
+# for every kana word, a dict from each start in romaji to a dict from each end to the number of typos
+AnchorMatches = list[dict[int, dict[int, int]]]
 
 
 def convert_kana_line(jap: list[Word], romaji: str) -> Optional[list[Word]]:
@@ -206,100 +408,245 @@ def convert_kana_line(jap: list[Word], romaji: str) -> Optional[list[Word]]:
     :param jap: A list of Japanese words
     :param romaji: the romaji matching jap
     :return: A list of words with corrected pronunciation if conversion is successful.
+    :raise SearchBudgetExceeded: if the line is too expensive to align
     """
     # FIXME: include pronunciation for numbers
     if len(jap) == 0:
         return []
     if len(romaji) == 0:
         return []
-    # records possible romaji combinations
-    romaji_list_list = []
+    memo = get_line_memo()
+    key = LineMemo.key(jap, romaji)
+    found, res = memo.get(key)
+    budget = config.config.line_search_budget
+    # a line given up with a budget at least as large is given up again without searching
+    if isinstance(res, GivenUp) and res.budget >= budget:
+        raise SearchBudgetExceeded(res.reason)
+    if not found or isinstance(res, GivenUp):
+        try:
+            res = match_line(jap, romaji)
+        except SearchBudgetExceeded as e:
+            memo.put(key, GivenUp(budget, str(e)))
+            raise
+        memo.put(key, res)
+    if res is None:
+        return None
+    return res[1]
+
+
+def match_line(jap: list[Word], romaji: str) -> Optional[tuple[int, list[Word]]]:
+    """
+    Match a line with its romaji, choosing the search strategy by the estimated cost of the line
+    :param jap: A list of Japanese words
+    :param romaji: the romaji matching jap
+    :return: The rating and the corrected words, or None if the line cannot be matched.
+    :raise SearchBudgetExceeded: if the line is too expensive to align
+    """
     # convert existing kana to romaji
     for word in jap:
         if word.type == Type.KANA:
             word.romaji = kana_to_romaji(word.surface)
-            romaji_list_list.append(word.romaji)
         elif word.type == Type.KANJI:
             word.romaji = kana_to_romaji(word.hiragana)
         else:
             word.romaji = [word.surface.lower()]
-    results = []
-    # this is the cartesian product of possible romaji combinations
-    # for example, 夏空を鮮明に will become
-    # [['o', 'wo'], ['ni']]
-    # because を has two transliterations
-    # itertools.product converts it to
-    # [['o'], ['ni'],
-    # ['wo'], ['ni']]
-    # the program tries each combination, and will figure out which
-    # one has the highest rating
-    for romaji_list in itertools.product(*romaji_list_list):
-        # remove empty ones from the list
-        romaji_list = [s for s in romaji_list if not is_empty(s)]
-        # find all possible ways the romaji from kana can match
-        # the known romaji
-        matches = find_all_matches_in_string(romaji, romaji_list)
-        for match in matches:
-            res = match_kanji_with_romaji(jap, match, romaji, romaji_list)
-            if res is not None:
-                results.append(res)
-    if len(results) == 0:
-        return None
-    return sorted(results, key=lambda t: t[0])[-1][1]
+    # most lines are spelled exactly by Yahoo's readings, which is the best possible rating
+    if probe_line(jap, romaji):
+        return 0, list(jap)
+    anchors = [w for w in jap if w.type == Type.KANA]
+    # the fuzzy pass continues where the exact pass left off instead of starting over
+    budget = SearchBudget(config.config.line_search_budget, romaji)
+
+    def search(anchor_matches: AnchorMatches) -> Optional[tuple[int, list[Word]]]:
+        cost = estimate_line_cost(anchor_matches)
+        beam_width = None
+        if cost > config.config.line_exhaustive_search_limit:
+            get_logger().debug("Estimated cost of {} for {}; using beam search".format(cost, romaji))
+            beam_width = config.config.line_search_beam_width
+        return align_words_with_romaji(jap, romaji, beam_width=beam_width, budget=budget,
+                                       anchor_matches=anchor_matches)
+
+    res = search(find_anchor_matches(anchors, romaji))
+    # a typo in the romaji of a kana makes exact matching fail; allow a few edits before giving up
+    if res is None and config.config.fuzzy_anchor_errors > 0:
+        res = search(find_fuzzy_anchor_matches(anchors, romaji, config.config.fuzzy_anchor_errors))
+        # a typo only excuses the kana around it; a reading the kanji cannot have means the romaji
+        # was split in the wrong places, so the line keeps Yahoo's readings instead
+        if res is not None and not readings_plausible(jap, res[1]):
+            return None
+    return res
 
 
-def match_kanji_with_romaji(jap: list[Word], match: list[int],
-                            romaji: str, romaji_list: list[str]) -> Optional[tuple[int, list[Word]]]:
-    # FIXME: weight issues with 1回 いっかい
+def readings_plausible(before: list[Word], after: list[Word]) -> bool:
     """
-    Match a list of Japanese words with romaji
-    :param jap: List of Japanese words
-    :param match: List of known matches between kana and romaji
-    :param romaji: romaji string
-    :param romaji_list: list of known romaji
-    :return: The rating of the resulting matching, and the corrected list of words
+    :param before: Words of a line before matching
+    :param after: The same words after matching
+    :return: True if every kanji word kept its reading or took one rated MATCHING_KANA
+    """
+    return all(b.hiragana == a.hiragana or is_valid_reading(a.surface, a.hiragana, variants=True)
+               for b, a in zip(before, after) if a.type == Type.KANJI)
+
+
+def find_anchor_matches(anchors: list[Word], romaji: str) -> AnchorMatches:
+    """
+    Find where the romaji of each kana word can occur
+    :param anchors: Kana words
+    :param romaji: romaji of the line
+    :return: For every anchor, a dict from each start in romaji to the ends of the variants matching there.
+    Every end maps to 0, the number of edits needed.
     """
-    word_index = 0
-    romaji_index = 0
     result = []
-    rating_sum = 0
-    for index in range(len(match)):
-        unmatched = []
-        # find a sequence of unmatched kanji/english
-        while jap[word_index].type != Type.KANA:
-            unmatched.append(jap[word_index])
-            word_index += 1
-        # check if unmatched kanji exist
-        if len(unmatched) != 0:
-            # try to perform a guess
-            res = match_non_kana_with_romaji(
-                jap[word_index - len(unmatched):word_index],
-                romaji[romaji_index:match[index]])
-            if not res:
-                return None
-            # add the change in rating ot the overall rating
-            rating, words = res
-            rating_sum += rating
-            result.extend(words)
-        # add unmodified kana to result
-        romaji_index = match[index] + len(romaji_list[index])
-        result.append(jap[word_index])
-        word_index += 1
-    # check if the line ends with kanji
-    if word_index < len(jap):
-        res = match_non_kana_with_romaji(jap[word_index:], romaji[romaji_index:])
-        if not res:
+    for anchor in anchors:
+        lattice = kana_to_romaji_lattice(anchor.surface)
+        matches = {}
+        for start in range(len(romaji) + 1):
+            ends = lattice.matches(romaji, start)
+            if len(ends) > 0:
+                matches[start] = {end: 0 for end in ends}
+        result.append(matches)
+    return result
+
+
+def find_fuzzy_anchor_matches(anchors: list[Word], romaji: str, max_errors: int) -> AnchorMatches:
+    """
+    Find where the romaji of each kana word can occur with up to max_errors typos
+    :param anchors: Kana words
+    :param romaji: romaji of the line
+    :param max_errors: Maximum number of insertions, deletions and substitutions per anchor
+    :return: Same as find_anchor_matches, except that every end maps to the number of edits needed
+    """
+    # numpy is only loaded once a line needs it
+    from utils.fuzzy_match import fuzzy_find
+    return [fuzzy_find(kana_to_romaji_lattice(anchor.surface).variants(), romaji, max_errors)
+            for anchor in anchors]
+
+
+def estimate_line_cost(anchor_matches: AnchorMatches) -> int:
+    """
+    Estimate the work align_words_with_romaji does on a line before running it. Every place an anchor
+    matches is combined with every alignment of the previous anchors, and an anchor with more romaji
+    variants leaves more alignments behind.
+    :param anchor_matches: Result of find_anchor_matches
+    :return: Estimated number of work units, in the units counted against config.line_search_budget
+    """
+    cost = 0
+    states = 1
+    for matches in anchor_matches:
+        cost += len(matches) * states
+        states = max(1, sum(len(ends) for ends in matches.values()))
+    return cost + states
+
+
+def align_words_with_romaji(jap: list[Word], romaji: str, beam_width: Optional[int] = None,
+                            budget: Union[int, SearchBudget, None] = None,
+                            anchor_matches: Optional[AnchorMatches] = None) \
+        -> Optional[tuple[int, list[Word]]]:
+    """
+    Align a line of words with its romaji in one pass. Kana words are anchors whose romaji is
+    known up to a few alternatives; the runs of kanji and English words between them take
+    whatever romaji lies between the anchors and are rated by match_non_kana_with_romaji.
+    For example, in 夏空を鮮明に the anchors are を (o or wo) and に, and 夏空 and 鮮明 take
+    the romaji before and between them.
+    :param jap: A list of Japanese words whose romaji has been filled in
+    :param romaji: the romaji matching jap
+    :param beam_width: If given, only this many of the best alignments are kept after each anchor
+    :param budget: If given, the maximum number of work units to spend, or a budget shared with other searches
+    :param anchor_matches: Result of find_anchor_matches, if it has been computed already
+    :return: The rating of the best alignment and the corrected list of words, or None if
+    the words cannot be aligned with romaji.
+    :raise SearchBudgetExceeded: if budget runs out
+    """
+    # runs[i] is the run of non-kana words before the i-th anchor; the last run ends the line
+    runs: list[list[Word]] = [[]]
+    anchors: list[Word] = []
+    for word in jap:
+        if word.type == Type.KANA:
+            anchors.append(word)
+            runs.append([])
+        else:
+            runs[-1].append(word)
+    if anchor_matches is None:
+        anchor_matches = find_anchor_matches(anchors, romaji)
+    gap_cache: dict[tuple[int, int, int], Optional[tuple[int, list[Word]]]] = {}
+    if not isinstance(budget, SearchBudget):
+        budget = SearchBudget(budget, romaji)
+    spend = budget.spend
+
+    def match_gap(run_index: int, start: int, end: int) -> Optional[tuple[int, list[Word]]]:
+        key = (run_index, start, end)
+        if key not in gap_cache:
+            # matching the words of the gap is most of the work, so it is charged segment by segment
+            gap_cache[key] = match_non_kana_with_romaji(runs[run_index], romaji[start:end], budget)
+        return gap_cache[key]
+
+    # states maps the end of the last anchor in romaji to the best (rating, anchor starts, words) so far;
+    # anchor starts break ties in favour of later matches
+    states: dict[int, tuple[int, tuple[int, ...], list[Word]]] = {0: (0, (), [])}
+    for index, anchor in enumerate(anchors):
+        next_states: dict[int, tuple[int, tuple[int, ...], list[Word]]] = {}
+        # best state ending at or before start, used when no word has to be fitted before the anchor
+        # and the romaji in between is skipped
+        best_before = None
+        for start in range(len(romaji) + 1):
+            if start in states and (best_before is None or states[start][:2] > best_before[:2]):
+                best_before = states[start]
+            ends = anchor_matches[index].get(start)
+            if ends is None:
+                continue
+            best = None
+            if len(runs[index]) == 0:
+                spend(1)
+                best = best_before
+            else:
+                spend(len(states))
+                for prev_end, (rating, starts, words) in states.items():
+                    if prev_end > start:
+                        continue
+                    res = match_gap(index, prev_end, start)
+                    if res is None:
+                        continue
+                    candidate = (rating + res[0], starts, words + res[1])
+                    if best is None or candidate[:2] > best[:2]:
+                        best = candidate
+            for end, errors in ends.items():
+                base = best
+                # a kana without romaji, such as ー, skips nothing; otherwise it could drift to the end of
+                # the line and leave the words after it without romaji
+                if end == start and len(runs[index]) == 0:
+                    base = states.get(start)
+                if base is None:
+                    continue
+                candidate = (base[0] + errors * FUZZY_ANCHOR_ERROR, base[1] + (start,), base[2] + [anchor])
+                if end not in next_states or candidate[:2] > next_states[end][:2]:
+                    next_states[end] = candidate
+        if beam_width is not None and len(next_states) > beam_width:
+            kept = sorted(next_states.items(), key=lambda item: item[1][:2], reverse=True)[:beam_width]
+            next_states = dict(kept)
+        states = next_states
+        if len(states) == 0:
             return None
-        rating, words = res
-        rating_sum += rating
-        result.extend(words)
-    return rating_sum, result
+    # fit the words after the last anchor; romaji after it is ignored if there are none
+    spend(len(states))
+    best = None
+    for prev_end, (rating, starts, words) in states.items():
+        if len(runs[-1]) == 0:
+            candidate = (rating, starts, words)
+        else:
+            res = match_gap(len(anchors), prev_end, len(romaji))
+            if res is None:
+                continue
+            candidate = (rating + res[0], starts, words + res[1])
+        if best is None or candidate[:2] > best[:2]:
+            best = candidate
+    if best is None:
+        return None
+    return best[0], best[2]
 
 
 def remove_special_characters(s: str) -> str:
     res = []
-    for c in s:
-        if is_japanese(c) or c.isalnum() or c == ' ':
+    for c, japanese in zip(s, mask(s, JAPANESE)):
+        if japanese or c.isalnum() or c == ' ':
             res.append(c)
         else:
             res.append(" ")
@@ -332,21 +679,83 @@ def convert_kana(jap: list[str], romaji: list[str], logs: ConversionLog, page_id
     :param page_id: Id of the page. Not used.
     :return: A list of Word objects each storing the original kanji and the corresponding furigana.
     """
-    result: list[Word] = []
+    lines = convert_kana_lines(jap, romaji, logs, page_id)
+    if lines is None:
+        return None
+    return [word for line in lines for word in line]
+
+
+def convert_kana_lines(jap: list[str], romaji: list[str], logs: ConversionLog,
+                       page_id: str = "0") -> Optional[list[list[Word]]]:
+    """
+    Same as convert_kana, except that the words of each line are kept separate
+    :return: A list parallel with jap holding the words of each line.
+    """
     jap = [remove_special_characters(line) for line in jap]
+    yahoo_words = prepare_line_words(jap, page_id)
+    if yahoo_words is None:
+        return None
+    # readings confirmed many times in earlier edits take priority over Yahoo's guess
+    line_words = [apply_learned_readings(words) for words in yahoo_words]
+    matches = (match_line_words(words, r) for words, r in zip(line_words, romaji))
+    return collect_line_matches(jap, romaji, yahoo_words, line_words, matches, logs)
+
+
+def prepare_line_words(jap: list[str], page_id: str = "0") -> Optional[list[list[Word]]]:
+    """
+    Get Yahoo's words for every line of a song
+    :param jap: Lines of Japanese lyrics without special characters
+    :param page_id: Identifies the song in Yahoo's cache
+    :return: A list parallel with jap holding the words of each line, or None if Yahoo returned nothing.
+    """
     # query everything at once to avoid exceeding the API usage count of Yahoo
     # this will give a preliminary furigana
     word_list = yahoo.get_furigana("\n".join(jap), page_id)
     if not word_list:
         get_logger().warning("No Yahoo furigana returned")
         return None
-    # process line by line
-    for index, j in enumerate(jap):
-        # convert this line into separate parts
-        # kanji, kana, and english characters are stored separately
-        words = jap_line_to_words(j, word_list)
-        # match the list of words to the expected romaji for this line
-        line = convert_kana_line(words, romaji[index])
+    # resolve dictionary readings of every kanji word in the song at once
+    preload_word_kana(w.surface for w in word_list if w.type == Type.KANJI)
+    # convert each line into separate parts
+    # kanji, kana, and english characters are stored separately
+    return align_yahoo_words(jap, word_list)
+
+
+def match_line_words(words: list[Word], romaji: str) -> tuple[Optional[list[Word]], Optional[str]]:
+    """
+    Match the words of a line to the expected romaji for this line.
+    Only depends on its arguments, so lines can be matched in any order and in any process.
+    :return: The matched words, or None if they cannot be matched, and the reason if the search was given up.
+    """
+    try:
+        return convert_kana_line(words, romaji), None
+    except SearchBudgetExceeded as e:
+        return None, str(e)
+
+
+def collect_line_matches(jap: list[str], romaji: list[str], yahoo_words: list[list[Word]],
+                         line_words: list[list[Word]], matches: Iterable[tuple[Optional[list[Word]], Optional[str]]],
+                         logs: ConversionLog) -> Optional[list[list[Word]]]:
+    """
+    Put together the results of match_line_words for every line of a song
+    :param jap: Lines of Japanese lyrics
+    :param romaji: Lines of romaji
+    :param yahoo_words: Result of prepare_line_words
+    :param line_words: The words that were matched, which are used for lines that cannot be matched
+    :param matches: Results of match_line_words, in the order of the lines
+    :param logs: Records of event that happened during conversion
+    :return: A list parallel with jap holding the words of each line, or None if a line
+    cannot be matched and config.line_strict is set.
+    """
+    result: list[list[Word]] = []
+    for index, (line, budget_error) in enumerate(matches):
+        j = jap[index]
+        words = line_words[index]
+        if budget_error is not None:
+            # keep Yahoo's reading rather than let a single line stall the run
+            get_logger().warning("{} Using Yahoo's reading for {}.".format(budget_error, j))
+            logs.budget_exceeded_lines.append(j)
+            line = words
         if line is None:
             get_logger().warning("Line {} cannot be matched with {}.".format(j, romaji[index]))
             # if strict, then fail immediately
@@ -354,14 +763,14 @@ def convert_kana(jap: list[str], romaji: list[str], logs: ConversionLog, page_id
                 return None
             else:
                 line = words
-        log_diff(words, line, logs)
+        log_diff(yahoo_words[index], line, logs)
         # add this line to result
-        result.extend(line)
+        result.append(line)
     return result
 
 
 def is_invalid_furigana(word: Word) -> bool:
-    return word.hiragana not in get_pronunciations(word.surface)
+    return not is_valid_reading(word.surface, word.hiragana)
 
 
 def get_invalid_furigana(words: Union[list[Word], ConversionList]) -> Union[list[Word], ConversionList]:
@@ -370,4 +779,4 @@ def get_invalid_furigana(words: Union[list[Word], ConversionList]) -> Union[list
                 if is_invalid_furigana(w)]
     return [(before, after)
             for before, after in words
-            if after.hiragana not in get_pronunciations(after.surface)]
+            if not is_valid_reading(after.surface, after.hiragana)]
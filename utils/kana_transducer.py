@@ -0,0 +1,165 @@
+from typing import Optional, Iterator
+
+vowels = ['a', 'e', 'i', 'o', 'u']
+SOKUON = ['っ', 'ッ']
+CHOONPU = 'ー'
+
+
+class RomajiState:
+    """
+    Position of the transducer after reading a prefix of a romaji string.
+    """
+    __slots__ = ['output', 'buffer', 'prev']
+
+    def __init__(self, output: str = "", buffer: str = "", prev: str = ""):
+        # hiragana of all complete syllables read so far
+        self.output = output
+        # consonants read since the last vowel
+        self.buffer = buffer
+        # the last character read
+        self.prev = prev
+
+
+class KanaTransducer:
+    """
+    Converts between romaji and kana in one linear pass.
+    Romaji is read one character at a time, so a caller extending a candidate
+    can tell as soon as the prefix can no longer be converted.
+    """
+
+    def __init__(self, romaji_table: dict[str, str], katakana_table: dict[str, str],
+                 special: dict[str, list[str]]):
+        """
+        :param romaji_table: romaji syllable to hiragana
+        :param katakana_table: katakana to romaji
+        :param special: kana with more than one accepted romanisation
+        """
+        self.syllables = dict(romaji_table)
+        # consonant buffers that are complete on their own at the end of input, such as "n"
+        self.final_buffers = {k for k in self.syllables if k[-1] not in vowels}
+        # every buffer that can still be completed by a vowel
+        complete = {k[:-1] for k in self.syllables if k[-1] in vowels}
+        # っ before a single consonant: "kka"
+        complete |= {c + c for c in complete if len(c) == 1}
+        # ん before another syllable: "nka", "nkka"
+        complete |= {"n" + c for c in complete}
+        self.viable_buffers = {c[:i] for c in complete | self.final_buffers for i in range(len(c) + 1)}
+        # kana to romaji; a unit is either a single kana or a kana followed by a small kana
+        self.kana_units: dict[str, list[str]] = {}
+        for kana, romaji in katakana_table.items():
+            self.kana_units[kana] = [romaji]
+        for romaji, kana in romaji_table.items():
+            self.kana_units[kana] = [romaji]
+        for kana, options in special.items():
+            self.kana_units[kana] = list(options)
+        self.two_kana_units = {k for k in self.kana_units if len(k) == 2}
+
+    # romaji to kana
+
+    def convert_syllable(self, syllable: str, prev: str) -> Optional[str]:
+        """
+        Convert consonants followed by a vowel
+        :param syllable: A consonant buffer and the vowel that closed it
+        :param prev: The character before the vowel
+        :return: Hiragana, or None if the syllable cannot be converted
+        """
+        result = ""
+        if syllable[0] == 'n' and syllable not in self.syllables:
+            result += 'ん'
+            syllable = syllable[1:]
+        if len(syllable) == 3 and syllable[0] == syllable[1]:
+            result += 'っ'
+            syllable = syllable[1:]
+        # doo -> どう
+        if syllable[-1] == 'o' and prev == 'o':
+            return result + 'う'
+        kana = self.syllables.get(syllable)
+        if kana is None:
+            return None
+        return result + kana
+
+    def feed(self, state: RomajiState, c: str) -> Optional[RomajiState]:
+        """
+        Read one more character of romaji
+        :param state: State after the previous characters
+        :param c: The next character
+        :return: The next state, or None if no extension of the input can be converted.
+        """
+        if c in vowels:
+            kana = self.convert_syllable(state.buffer + c, state.prev)
+            if kana is None:
+                return None
+            return RomajiState(state.output + kana, "", c)
+        buffer = state.buffer + c
+        if buffer not in self.viable_buffers:
+            return None
+        return RomajiState(state.output, buffer, c)
+
+    def finish(self, state: RomajiState) -> Optional[str]:
+        """
+        :return: Hiragana of everything read so far, or None if the input ends in the middle of a syllable
+        """
+        if len(state.buffer) == 0:
+            return state.output
+        if state.buffer in self.final_buffers:
+            return state.output + self.syllables[state.buffer]
+        return None
+
+    def is_prefix(self, romaji: str) -> bool:
+        """
+        Check whether romaji can still be extended into something convertible
+        """
+        state = RomajiState()
+        for c in romaji:
+            state = self.feed(state, c)
+            if state is None:
+                return False
+        return True
+
+    def to_hiragana(self, romaji: str) -> Optional[str]:
+        state = RomajiState()
+        for c in romaji:
+            state = self.feed(state, c)
+            if state is None:
+                return None
+        return self.finish(state)
+
+    def prefixes(self, romaji: str, start: int = 0, end: int = None) -> Iterator[tuple[int, str]]:
+        """
+        Convert every prefix of romaji[start:end] in one pass, stopping as soon as no longer
+        prefix can be converted.
+        :return: Pairs of end index and the hiragana of romaji[start:end index].
+        The empty prefix is included.
+        """
+        if end is None:
+            end = len(romaji)
+        state = RomajiState()
+        for index in range(start, end + 1):
+            if index > start:
+                state = self.feed(state, romaji[index - 1])
+                if state is None:
+                    return
+            hiragana = self.finish(state)
+            if hiragana is not None:
+                yield index, hiragana
+
+    # kana to romaji
+
+    def romaji_options(self, kana: str) -> Optional[list[str]]:
+        """
+        :param kana: A single kana unit
+        :return: Accepted romanisations of the unit, or None if it is unknown.
+        """
+        return self.kana_units.get(kana)
+
+    def split_units(self, kana: str) -> list[str]:
+        """
+        Split kana into units such as "きゃ", "ッ" and "ー"
+        """
+        units = []
+        index = 0
+        while index < len(kana):
+            length = 2 if kana[index:index + 2] in self.two_kana_units else 1
+            units.append(kana[index:index + length])
+            index += length
+        return units
@@ -0,0 +1,90 @@
+from typing import Iterator, Iterable
+
+
+class Lattice:
+    """
+    A DAG of string fragments. Nodes are numbered 0 to size and every edge goes from a
+    node to a later node, so every path from node 0 to node size spells one accepted string.
+    Membership and prefix tests walk the DAG against the input instead of enumerating
+    every string, which grows exponentially with the number of alternatives.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        # edges[i] holds (j, fragment) for every edge from node i to node j
+        self.edges: list[list[tuple[int, str]]] = [[] for _ in range(size)]
+
+    @classmethod
+    def from_units(cls, units: list[Iterable[str]]) -> "Lattice":
+        """
+        Build a chain in which the i-th unit is one of its options
+        :param units: Alternatives for each position
+        :return: The lattice
+        """
+        lattice = cls(len(units))
+        for index, options in enumerate(units):
+            for option in options:
+                lattice.add(index, index + 1, option)
+        return lattice
+
+    def add(self, start: int, end: int, fragment: str):
+        if not 0 <= start < end <= self.size:
+            raise ValueError("Invalid edge from {} to {} in lattice of size {}".format(start, end, self.size))
+        if (end, fragment) not in self.edges[start]:
+            self.edges[start].append((end, fragment))
+
+    def matches(self, s: str, start: int = 0) -> list[int]:
+        """
+        Find every prefix of s[start:] that is accepted
+        :param s: A string
+        :param start: Index in s where matching starts
+        :return: Sorted end indices e such that s[start:e] is accepted
+        """
+        reach: list[set[int]] = [set() for _ in range(self.size + 1)]
+        reach[0].add(start)
+        for node in range(self.size):
+            for position in reach[node]:
+                for end, fragment in self.edges[node]:
+                    if s.startswith(fragment, position):
+                        reach[end].add(position + len(fragment))
+        return sorted(reach[self.size])
+
+    def accepts(self, s: str) -> bool:
+        return len(s) in self.matches(s)
+
+    def __contains__(self, s: str) -> bool:
+        return self.accepts(s)
+
+    def count_paths(self) -> int:
+        """
+        :return: Number of paths through the lattice. Strings spelled by several paths are counted once per path.
+        """
+        paths = [0] * (self.size + 1)
+        paths[0] = 1
+        for node in range(self.size):
+            for end, _ in self.edges[node]:
+                paths[end] += paths[node]
+        return paths[self.size]
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Lazily spell every path. A string may be produced more than once.
+        """
+        def walk(node: int, prefix: str) -> Iterator[str]:
+            if node == self.size:
+                yield prefix
+                return
+            for end, fragment in self.edges[node]:
+                yield from walk(end, prefix + fragment)
+
+        return walk(0, "")
+
+    def variants(self) -> Iterator[str]:
+        """
+        Lazily spell every distinct accepted string
+        """
+        seen = set()
+        for s in self:
+            if s not in seen:
+                seen.add(s)
+                yield s
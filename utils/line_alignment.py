@@ -0,0 +1,85 @@
+import difflib
+import re
+from typing import Optional
+
+from utils.japanese_char import mask, JAPANESE, contains_class, KANJI
+
+template_pattern = re.compile(r"\{\{[^{}|]*\|([^{}|]*)(?:\|[^{}]*)?}}")
+# lines in corresponding places that differ by more than this are not paired
+MIN_LINE_SIMILARITY = 0.6
+
+
+def line_signature(line: str) -> str:
+    """
+    Normalise a line of lyrics so that the same line from MGP and from Vocaloid Lyrics Wiki compares equal.
+    Templates such as {{photrans|漢字|かんじ}} are replaced by their first argument and everything
+    but Japanese characters is dropped.
+    :param line: A line of lyrics
+    :return: The signature of the line
+    """
+    line = template_pattern.sub(r"\1", line)
+    return "".join(c for c, japanese in zip(line, mask(line, JAPANESE)) if japanese)
+
+
+def align_lines(target: list[str], source: list[str]) -> list[Optional[int]]:
+    """
+    Find the counterpart in source of every line in target. Lines are compared by signature, so the diff
+    runs over one integer per line. Lines in a changed region are paired in order if they are similar,
+    and lines without a counterpart in place, such as a chorus written out on only one side, are paired
+    with the first source line with the same signature.
+    :param target: Lines to find counterparts for
+    :param source: Lines to look in
+    :return: A list parallel with target holding the index of the counterpart in source, or None.
+    """
+    target_signatures = [line_signature(line) for line in target]
+    source_signatures = [line_signature(line) for line in source]
+    ids: dict[str, int] = {}
+    a = [ids.setdefault(s, len(ids)) for s in target_signatures]
+    b = [ids.setdefault(s, len(ids)) for s in source_signatures]
+    result: list[Optional[int]] = [None] * len(target)
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(i2 - i1):
+                result[i1 + k] = j1 + k
+        elif tag == "replace":
+            j = j1
+            for i in range(i1, i2):
+                for candidate in range(j, j2):
+                    similarity = difflib.SequenceMatcher(None, target_signatures[i],
+                                                         source_signatures[candidate]).ratio()
+                    if similarity >= MIN_LINE_SIMILARITY:
+                        result[i] = candidate
+                        j = candidate + 1
+                        break
+    first: dict[str, int] = {}
+    for j, s in enumerate(source_signatures):
+        first.setdefault(s, j)
+    for i, s in enumerate(target_signatures):
+        if result[i] is None and s in first:
+            result[i] = first[s]
+    return result
+
+
+def unaligned_regions(target: list[str], alignment: list[Optional[int]]) -> list[tuple[int, int]]:
+    """
+    :param target: Lines passed to align_lines
+    :param alignment: Result of align_lines
+    :return: Maximal ranges (start, end) of lines with kanji but without a counterpart.
+    Lines without kanji do not break a range.
+    """
+    regions = []
+    start = None
+    end = None
+    for index, (line, counterpart) in enumerate(zip(target, alignment)):
+        if counterpart is not None:
+            if start is not None:
+                regions.append((start, end))
+                start = None
+        elif contains_class(line, KANJI):
+            if start is None:
+                start = index
+            end = index + 1
+    if start is not None:
+        regions.append((start, end))
+    return regions
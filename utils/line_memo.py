@@ -0,0 +1,159 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import config.config
+from models.lyrics import Word, Type
+from utils.caching import load_object, save_object
+from utils.japanese_char import KANJI_READING_TABLE_VERSION, WORD_KANA_TABLE_VERSION
+from utils.logger import get_logger
+from utils.reading_store import READING_STORE_VERSION, get_reading_store
+
+line_memo_filename = "line_memo.pickle"
+# bumped whenever a change to matching changes its results
+LINE_MEMO_VERSION = 2
+
+
+@dataclass(frozen=True)
+class GivenUp:
+    """
+    A line whose alignment was given up because it took more work than the budget allowed
+    """
+    budget: int
+    reason: str
+
+
+LineResult = Union[tuple[int, list[Word]], GivenUp, None]
+
+
+def copy_words(words: list[Word]) -> list[Word]:
+    return [Word(w.surface, w.type, romaji=list(w.romaji), hiragana=w.hiragana) for w in words]
+
+
+def settings_fingerprint() -> str:
+    """
+    :return: The settings and data versions that alignments depend on besides the line itself
+    """
+    return "{}|{}|{}|{}|{}|{}".format(config.config.fuzzy_anchor_errors, config.config.line_search_beam_width,
+                                      config.config.line_exhaustive_search_limit, KANJI_READING_TABLE_VERSION,
+                                      WORD_KANA_TABLE_VERSION, READING_STORE_VERSION)
+
+
+class LineMemo:
+    """
+    Bounded memo of line alignments, evicting the least recently used line first.
+    Choruses repeat within a song and covers reuse whole songs, so the same line
+    is often aligned many times. It may be shared by several threads.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[str, LineResult] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        # move_to_end and eviction reorder the entries, so every access holds the lock
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(words: list[Word], romaji: str) -> str:
+        """
+        :param words: Words of the line as given by Yahoo, before alignment
+        :param romaji: Romaji of the line
+        :return: A digest of everything the alignment depends on: the line, the settings of the search,
+        the versions of the dictionary tables and the readings learned for the kanji of the line
+        """
+        h = hashlib.sha1(settings_fingerprint().encode("utf-8"))
+        store = get_reading_store()
+        for w in words:
+            h.update("{}\x1f{}\x1f{}\x1e".format(w.surface, w.type.name, w.hiragana).encode("utf-8"))
+            if w.type == Type.KANJI:
+                h.update(repr(store.readings(w.surface)).encode("utf-8"))
+        h.update(romaji.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> tuple[bool, LineResult]:
+        """
+        :return: Whether key is memoised and, if so, the rating and words stored for it.
+        The rating and words are None if the line could not be aligned, or GivenUp if the search was given up.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            res = self.entries[key]
+        if res is None or isinstance(res, GivenUp):
+            return True, res
+        return True, (res[0], copy_words(res[1]))
+
+    def put(self, key: str, res: LineResult):
+        if res is not None and not isinstance(res, GivenUp):
+            res = (res[0], copy_words(res[1]))
+        with self.lock:
+            self.entries[key] = res
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0
+        return "Line memo: {} hits, {} misses ({:.0%} hit rate), {} lines stored.".format(
+            self.hits, self.misses, rate, len(self.entries))
+
+
+line_memo: Optional[LineMemo] = None
+line_memo_lock = threading.Lock()
+# pages converted since the memo was last saved
+pages_since_save = 0
+
+
+def get_line_memo() -> LineMemo:
+    global line_memo
+    with line_memo_lock:
+        if line_memo is not None:
+            return line_memo
+        line_memo = LineMemo(config.config.line_memo_size)
+        saved = load_object(line_memo_filename)
+        if saved is not None and saved[0] == LINE_MEMO_VERSION:
+            line_memo.entries = saved[1]
+            while len(line_memo.entries) > line_memo.max_size:
+                line_memo.entries.popitem(last=False)
+    return line_memo
+
+
+def save_line_memo():
+    """
+    Write the memo to the cache directory if it changed since it was loaded or last saved
+    :return: None
+    """
+    global pages_since_save
+    pages_since_save = 0
+    if line_memo is None:
+        return
+    with line_memo.lock:
+        if not line_memo.dirty:
+            return
+        save_object(line_memo_filename, (LINE_MEMO_VERSION, line_memo.entries))
+        line_memo.dirty = False
+    get_logger().debug("Saved {} memoised lines".format(len(line_memo)))
+
+
+def checkpoint_line_memo():
+    """
+    Save the memo after every config.line_memo_save_interval pages. The memo is large, so it is
+    not rewritten after every page; call save_line_memo when done to save the rest.
+    :return: None
+    """
+    global pages_since_save
+    pages_since_save += 1
+    if pages_since_save >= config.config.line_memo_save_interval:
+        save_line_memo()
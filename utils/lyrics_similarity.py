@@ -0,0 +1,73 @@
+import random
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+
+from utils.japanese_char import mask, KANJI
+
+MINHASH_SIZE = 64
+MAX_HASH = 0xFFFFFFFF
+MERSENNE_PRIME = (1 << 61) - 1
+# independent multipliers and offsets of the hash functions ((a * h + b) mod p) used by MinHash,
+# drawn with a fixed seed so that signatures are comparable across runs
+minhash_rng = random.Random(0x4D696E48)
+minhash_seeds = [(minhash_rng.randrange(1, MERSENNE_PRIME), minhash_rng.randrange(0, MERSENNE_PRIME))
+                 for _ in range(MINHASH_SIZE)]
+
+
+@dataclass
+class LyricsSignature:
+    """
+    Summary of the kanji in a text of lyrics. Comparing two signatures takes time proportional
+    to the number of distinct kanji instead of a scan of the other text per kanji.
+    """
+    # occurrences of each kanji
+    kanji: Counter
+    # occurrences of each pair of consecutive kanji, ignoring everything in between
+    bigrams: Counter
+    # MinHash of the set of bigrams, for estimating similarity without the bigrams themselves
+    minhash: tuple[int, ...]
+
+    @property
+    def total(self) -> int:
+        return sum(self.kanji.values())
+
+
+def get_signature(text: str) -> LyricsSignature:
+    kanji = [c for c, is_k in zip(text, mask(text, KANJI)) if is_k]
+    bigrams = Counter(a + b for a, b in zip(kanji, kanji[1:]))
+    hashes = [zlib.crc32(b.encode("utf-8")) for b in bigrams]
+    minhash = tuple(min((((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes), default=MAX_HASH)
+                    for a, b in minhash_seeds)
+    return LyricsSignature(Counter(kanji), bigrams, minhash)
+
+
+def kanji_mismatch(expected: LyricsSignature, candidate: LyricsSignature) -> list[str]:
+    """
+    :return: Every occurrence of a kanji in expected that never occurs in candidate
+    """
+    return [c for c, count in expected.kanji.items() if c not in candidate.kanji for _ in range(count)]
+
+
+def estimate_jaccard(a: LyricsSignature, b: LyricsSignature) -> float:
+    """
+    :return: An estimate of the Jaccard similarity of the kanji bigrams of a and b
+    """
+    return sum(1 for x, y in zip(a.minhash, b.minhash) if x == y) / MINHASH_SIZE
+
+
+def rank_candidates(expected: LyricsSignature, candidates: list[LyricsSignature]) -> list[tuple[int, float]]:
+    """
+    Rank candidate lyrics by how well they cover the kanji of the expected lyrics
+    :param expected: Signature of the lyrics being looked for
+    :param candidates: Signatures of the candidates
+    :return: Pairs of index into candidates and the share of kanji occurrences of expected found in the candidate,
+    best first. Candidates with the same share are ordered by the similarity of their bigrams.
+    """
+    scores = []
+    for index, candidate in enumerate(candidates):
+        total = expected.total
+        coverage = 1 - len(kanji_mismatch(expected, candidate)) / total if total > 0 else 1
+        scores.append((coverage, estimate_jaccard(expected, candidate), index))
+    scores.sort(key=lambda t: (t[0], t[1]), reverse=True)
+    return [(index, coverage) for coverage, _, index in scores]
@@ -0,0 +1,114 @@
+import threading
+from typing import Optional, Iterable
+
+import config.config
+from models.lyrics import Word, Type
+from utils.caching import load_object, save_object
+from utils.logger import get_logger
+
+reading_store_filename = "reading_store.pickle"
+READING_STORE_VERSION = 1
+
+
+class ReadingStore:
+    """
+    Counts of the readings confirmed for each surface in saved edits. It may be shared by several threads.
+    """
+
+    def __init__(self):
+        self.counts: dict[str, dict[str, int]] = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def record(self, surface: str, hiragana: str):
+        with self.lock:
+            readings = self.counts.setdefault(surface, {})
+            readings[hiragana] = readings.get(hiragana, 0) + 1
+            self.dirty = True
+
+    def readings(self, surface: str) -> list[tuple[str, int]]:
+        """
+        :param surface: Surface of a word
+        :return: Confirmed readings of surface and their counts, most frequent first
+        """
+        with self.lock:
+            readings = list(self.counts.get(surface, {}).items())
+        return sorted(readings, key=lambda p: p[1], reverse=True)
+
+    def confident_reading(self, surface: str) -> Optional[str]:
+        """
+        :param surface: Surface of a word
+        :return: The reading of surface if it has been confirmed at least config.reading_store_min_count
+        times and makes up at least config.reading_store_min_share of all confirmations. None otherwise.
+        """
+        readings = self.readings(surface)
+        if len(readings) == 0:
+            return None
+        hiragana, count = readings[0]
+        total = sum(c for _, c in readings)
+        if count >= config.config.reading_store_min_count and count / total >= config.config.reading_store_min_share:
+            return hiragana
+        return None
+
+    def __len__(self):
+        return len(self.counts)
+
+
+reading_store: Optional[ReadingStore] = None
+reading_store_lock = threading.Lock()
+
+
+def get_reading_store() -> ReadingStore:
+    global reading_store
+    with reading_store_lock:
+        if reading_store is not None:
+            return reading_store
+        store = ReadingStore()
+        saved = load_object(reading_store_filename)
+        if saved is not None and saved[0] == READING_STORE_VERSION:
+            store.counts = saved[1]
+        reading_store = store
+    return reading_store
+
+
+def save_reading_store():
+    if reading_store is None:
+        return
+    with reading_store.lock:
+        if not reading_store.dirty:
+            return
+        save_object(reading_store_filename, (READING_STORE_VERSION, reading_store.counts))
+        reading_store.dirty = False
+
+
+def record_confirmed_readings(words: Iterable[Word]):
+    """
+    Remember the readings of kanji words in an edit that has been saved
+    :param words: Words in the saved edit
+    :return: None
+    """
+    store = get_reading_store()
+    count = 0
+    for w in words:
+        if w.type == Type.KANJI and len(w.hiragana) > 0:
+            store.record(w.surface, w.hiragana)
+            count += 1
+    save_reading_store()
+    get_logger().debug("Recorded {} confirmed readings; {} words known".format(count, len(store)))
+
+
+def apply_learned_readings(words: list[Word]) -> list[Word]:
+    """
+    Replace Yahoo's readings with confidently learned ones
+    :param words: Words of a line as given by Yahoo
+    :return: A new list in which every kanji word with a confident reading carries that reading
+    """
+    store = get_reading_store()
+    result = []
+    for w in words:
+        hiragana = store.confident_reading(w.surface) if w.type == Type.KANJI else None
+        if hiragana is None or hiragana == w.hiragana:
+            result.append(w)
+        else:
+            result.append(Word(w.surface, w.type, romaji=list(w.romaji), hiragana=hiragana))
+    return result
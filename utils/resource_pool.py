@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ResourcePool(Generic[T]):
+    """
+    A bounded pool of resources that must not be used by two threads at once, such as
+    pykakasi converters. A thread gets back the resource it used last
+    whenever that one is idle and only takes over another thread's resource once the pool is full,
+    so as long as there are no more threads than resources every thread keeps its own.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T], max_size: int,
+                 close: Optional[Callable[[T], None]] = None):
+        if max_size < 1:
+            raise ValueError("Pool {} needs room for at least one resource".format(name))
+        self.name = name
+        self.factory = factory
+        self.max_size = max_size
+        self.close_resource = close
+        self.condition = threading.Condition()
+        self.idle: list[T] = []
+        self.local = threading.local()
+        self.size = 0
+        self.in_use = 0
+        # metrics
+        self.created = 0
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.peak_in_use = 0
+
+    def take(self) -> T:
+        with self.condition:
+            self.acquisitions += 1
+            preferred = getattr(self.local, "resource", None)
+            if preferred is not None and any(r is preferred for r in self.idle):
+                resource = preferred
+                self.idle = [r for r in self.idle if r is not preferred]
+            elif self.size < self.max_size:
+                # reserve the slot and create the resource outside of the lock
+                resource = None
+                self.size += 1
+            else:
+                if len(self.idle) == 0:
+                    self.waits += 1
+                    start = time.perf_counter()
+                    while len(self.idle) == 0:
+                        self.condition.wait()
+                    self.wait_seconds += time.perf_counter() - start
+                resource = self.idle.pop()
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if resource is None:
+            try:
+                resource = self.factory()
+            except BaseException:
+                with self.condition:
+                    self.size -= 1
+                    self.in_use -= 1
+                    self.condition.notify()
+                raise
+            with self.condition:
+                self.created += 1
+        self.local.resource = resource
+        return resource
+
+    def give_back(self, resource: T):
+        with self.condition:
+            self.idle.append(resource)
+            self.in_use -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a resource for the duration of a with block, waiting if all of them are in use
+        """
+        resource = self.take()
+        try:
+            yield resource
+        finally:
+            self.give_back(resource)
+
+    def close(self):
+        """
+        Close all idle resources. Resources in use are closed when they are given back and the pool is closed again.
+        :return: None
+        """
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        if self.close_resource is not None:
+            for resource in idle:
+                self.close_resource(resource)
+
+    def summary(self) -> str:
+        return "{}: {} created (max {}), {} acquisitions, {} waits ({:.2f}s), peak {} in use".format(
+            self.name, self.created, self.max_size, self.acquisitions, self.waits,
+            self.wait_seconds, self.peak_in_use)
@@ -0,0 +1,120 @@
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Optional
+
+MAGIC = b"MGPT"
+header_struct = struct.Struct("<4sII")
+record_struct = struct.Struct("<IIII")
+VALUE_SEPARATOR = "\x1f"
+
+
+def write_string_table(path: Path, items: Iterable[tuple[str, Iterable[str]]], version: int = 1):
+    """
+    Serialize a mapping from str to a list of str into a compact binary table
+    :param path: Where the table is written to
+    :param items: Pairs of key and values. Values of duplicate keys are merged.
+    :param version: Format version stored in the header; readers reject other versions.
+    :return: None
+    """
+    merged: dict[bytes, list[str]] = {}
+    for key, values in items:
+        lst = merged.setdefault(key.encode("utf-8"), [])
+        for v in values:
+            if v not in lst:
+                lst.append(v)
+    keys = sorted(merged)
+    blob = bytearray()
+    records = bytearray()
+    base = header_struct.size + record_struct.size * len(keys)
+    for key in keys:
+        value = VALUE_SEPARATOR.join(merged[key]).encode("utf-8")
+        key_offset = base + len(blob)
+        blob.extend(key)
+        value_offset = base + len(blob)
+        blob.extend(value)
+        records.extend(record_struct.pack(key_offset, len(key), value_offset, len(value)))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(temp_path, "wb") as f:
+        f.write(header_struct.pack(MAGIC, version, len(keys)))
+        f.write(records)
+        f.write(blob)
+    temp_path.replace(path)
+
+
+class StringTable:
+    """
+    Read-only, memory-mapped view of a table written by write_string_table.
+    Keys are sorted by their UTF-8 bytes, so a lookup is a binary search over
+    fixed-size records and never decodes anything but the requested values.
+    """
+
+    def __init__(self, path: Path, version: int = 1):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_version, self.count = header_struct.unpack_from(self.mm, 0)
+        if magic != MAGIC or file_version != version:
+            self.mm.close()
+            raise ValueError("{} is not a string table of version {}".format(path, version))
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, index: int) -> tuple[int, int, int, int]:
+        return record_struct.unpack_from(self.mm, header_struct.size + index * record_struct.size)
+
+    def _key(self, index: int) -> bytes:
+        key_offset, key_length, _, _ = self._record(index)
+        return self.mm[key_offset:key_offset + key_length]
+
+    def _lower_bound(self, key: bytes, lo: int = 0) -> int:
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _values(self, index: int) -> list[str]:
+        _, _, value_offset, value_length = self._record(index)
+        if value_length == 0:
+            return []
+        return self.mm[value_offset:value_offset + value_length].decode("utf-8").split(VALUE_SEPARATOR)
+
+    def get(self, key: str) -> Optional[list[str]]:
+        """
+        Look up a single key
+        :param key: The key to look up
+        :return: The list of values, or None if the key does not exist.
+        """
+        encoded = key.encode("utf-8")
+        index = self._lower_bound(encoded)
+        if index < self.count and self._key(index) == encoded:
+            return self._values(index)
+        return None
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, list[str]]:
+        """
+        Look up many keys in one sorted sweep over the table
+        :param keys: Keys to look up
+        :return: A dict from every key found in the table to its values. Missing keys are left out.
+        """
+        result = {}
+        lo = 0
+        for encoded in sorted(set(k.encode("utf-8") for k in keys)):
+            lo = self._lower_bound(encoded, lo)
+            if lo >= self.count:
+                break
+            if self._key(lo) == encoded:
+                result[encoded.decode("utf-8")] = self._values(lo)
+        return result
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def close(self):
+        self.mm.close()
@@ -1,4 +1,8 @@
-from typing import Optional, Iterable, Callable, Union
+import bisect
+import functools
+import re
+from dataclasses import dataclass, field
+from typing import Optional, Iterable, Callable, Union, Iterator
 
 
 def find_in_string(s: str, lst: list[str]) -> list[int]:
@@ -37,54 +41,115 @@ def find_all_matches_in_string(s: str, lst: Iterable[str]) -> list[list[int]]:
     return result
 
 
+bracket_pattern = re.compile(r"\{\{|\}\}")
+
+
+class BracketDepthMap:
+    """
+    Nesting depth of {{ and }} in a text, computed in one pass. The text is cut at every bracket pair
+    into runs of constant depth; the brackets themselves belong to no run. Unmatched }} make the depth negative.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        # start, end and depth of each run; run k + 1 starts right after the bracket pair that ends run k
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self.depths: list[int] = []
+        depth = 0
+        prev = 0
+        for match in bracket_pattern.finditer(text):
+            self.add_run(prev, match.start(), depth)
+            depth += 1 if match.group() == "{{" else -1
+            prev = match.end()
+        self.add_run(prev, len(text), depth)
+
+    def add_run(self, start: int, end: int, depth: int):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.depths.append(depth)
+
+    def run_at(self, index: int) -> int:
+        return max(bisect.bisect_right(self.starts, index) - 1, 0)
+
+    def depth_at(self, index: int) -> int:
+        """
+        :return: The depth of the character at index. Brackets count as part of the text before them.
+        """
+        return self.depths[self.run_at(index)]
+
+    def top_level_ranges(self, index: int) -> Iterator[tuple[int, int]]:
+        """
+        :return: Ranges of the text after index at the same depth as index, up to the }} that closes that depth
+        """
+        run = self.run_at(index)
+        base = self.depths[run]
+        for k in range(run, len(self.starts)):
+            if self.depths[k] < base:
+                return
+            if self.depths[k] == base:
+                start = max(index, self.starts[k])
+                if start < self.ends[k]:
+                    yield start, self.ends[k]
+
+    def find(self, symbol: Union[str, Callable[[str], bool]], index: int = 0) -> int:
+        """
+        :return: The first occurrence of symbol, or of a character matching a predicate, at the same
+        depth as index and before that depth is closed. -1 if there is none.
+        """
+        for start, end in self.top_level_ranges(index):
+            if isinstance(symbol, str):
+                res = self.text.find(symbol, start, end)
+                if res != -1:
+                    return res
+            else:
+                for i in range(start, end):
+                    if symbol(self.text[i]):
+                        return i
+        return -1
+
+    def count(self, symbol: Union[str, Callable[[str], bool]], index: int = 0) -> int:
+        """
+        :return: Number of occurrences that find would visit one after another
+        """
+        result = 0
+        for start, end in self.top_level_ranges(index):
+            if isinstance(symbol, str):
+                result += self.text.count(symbol, start, end)
+            else:
+                result += sum(1 for c in self.text[start:end] if symbol(c))
+        return result
+
+    def closing(self, index: int = 0) -> int:
+        """
+        :return: The index after the }} that closes the depth of index, or the length of the text if it is not closed
+        """
+        run = self.run_at(index)
+        base = self.depths[run]
+        for k in range(run + 1, len(self.starts)):
+            if self.depths[k] < base:
+                return self.starts[k]
+        return len(self.text)
+
+
+@functools.lru_cache(maxsize=32)
+def get_depth_map(text: str) -> BracketDepthMap:
+    """
+    Depth maps are shared by all scans of the same text
+    """
+    return BracketDepthMap(text)
+
+
 def count_symbol_not_in_bracket(text: str, symbol: Union[str, Callable[[str], bool]], index: int = 0) -> int:
-    answer = 0
-    while True:
-        res = find_symbol_not_in_bracket(text, symbol, index)
-        if res == -1:
-            return answer
-        answer += 1
-        index = res + 1
+    return get_depth_map(text).count(symbol, index)
 
 
 def find_symbol_not_in_bracket(text: str, symbol: Union[str, Callable[[str], bool]], index: int = 0) -> int:
-    stack = []
-    if isinstance(symbol, str):
-        predicate = lambda s: s == symbol
-    else:
-        predicate = symbol
-    while index < len(text) - 1:
-        two_chars = text[index: index + 2]
-        if two_chars == "{{":
-            stack.append(True)
-            index += 1
-        elif two_chars == "}}":
-            if len(stack) > 0:
-                stack.pop()
-            else:
-                return -1
-            index += 1
-        if predicate(text[index]) and len(stack) == 0:
-            return index
-        index += 1
-    if index == len(text) - 1 and text[index] == symbol:
-        return index
-    return -1
+    return get_depth_map(text).find(symbol, index)
 
 
 def find_closing_bracket(text: str, index: int = 0) -> int:
-    stack = []
-    while index < len(text) - 1:
-        two_chars = text[index: index + 2]
-        if two_chars == "{{":
-            stack.append(True)
-        elif two_chars == "}}":
-            if len(stack) == 0:
-                return index + 2
-            stack.pop()
-            index += 1
-        index += 1
-    return len(text)
+    return get_depth_map(text).closing(index)
 
 
 def extract_lyrics_kai(text: str) -> Optional[tuple[int, int]]:
@@ -133,3 +198,119 @@ def extract_japanese_lyrics(text: str) -> Optional[tuple[int, int]]:
 
 def strip_each_line(s: str) -> str:
     return "\n".join([line.strip() for line in s.split("\n")])
+
+
+def normalise_title(title: str) -> str:
+    return title.strip().replace("_", " ").upper()
+
+
+# (start, end, replacement) of a piece of text to replace
+Patch = tuple[int, int, str]
+
+
+@dataclass
+class TemplateSpan:
+    """
+    Where a template and its arguments are in a text, found without parsing the whole text
+    """
+    text: str = field(repr=False)
+    name: str
+    # index of the opening {{ and the index after the closing }}
+    start: int
+    end: int
+    # spans of the values of the arguments by name; positional arguments are named "1", "2", ...
+    arguments: dict[str, tuple[int, int]] = field(default_factory=dict)
+
+    def get_arg(self, name: str) -> Optional[str]:
+        span = self.arguments.get(name.strip())
+        return None if span is None else self.text[span[0]:span[1]]
+
+    def contains(self, other: "TemplateSpan") -> bool:
+        return self.start < other.start and other.end <= self.end
+
+
+def split_template_arguments(text: str, start: int, end: int) -> list[tuple[int, int, int]]:
+    """
+    Split the arguments of a template at the pipes that are not inside nested templates or links
+    :param text: The text the template is in
+    :param start: Index of the first pipe of the template
+    :param end: Index of the closing }} of the template
+    :return: The start, the index of the first equals sign or -1, and the end of each argument, without the pipes
+    """
+    result = []
+    depth = 0
+    index = start + 1
+    arg_start = index
+    equals = -1
+    while index < end:
+        two_chars = text[index: index + 2]
+        if two_chars == "{{" or two_chars == "[[":
+            depth += 1
+            index += 2
+            continue
+        if two_chars == "}}" or two_chars == "]]":
+            depth = max(depth - 1, 0)
+            index += 2
+            continue
+        if depth == 0:
+            if text[index] == "|":
+                result.append((arg_start, equals, index))
+                arg_start = index + 1
+                equals = -1
+            elif text[index] == "=" and equals == -1:
+                equals = index
+        index += 1
+    result.append((arg_start, equals, end))
+    return result
+
+
+def scan_templates(text: str, name: str) -> list[TemplateSpan]:
+    """
+    Find all templates with a name, nested ones included, by looking at the name after every {{
+    and matching brackets only for the templates that are wanted
+    :param text: Wikitext
+    :param name: Name of the template, compared like MediaWiki does
+    :return: The templates in the order they appear
+    """
+    target = normalise_title(name)
+    result = []
+    index = text.find("{{")
+    while index != -1:
+        name_start = index + 2
+        name_end = name_start
+        while name_end < len(text) and text[name_end] not in "|{}":
+            name_end += 1
+        if name_end < len(text) and text[name_end] != "{" and normalise_title(text[name_start:name_end]) == target:
+            end = find_closing_bracket(text, name_start)
+            if text.endswith("}}", 0, end) and end > name_end:
+                template = TemplateSpan(text, text[name_start:name_end].strip(), index, end)
+                if text[name_end] == "|":
+                    position = 0
+                    for arg_start, equals, arg_end in split_template_arguments(text, name_end, end - 2):
+                        if equals == -1:
+                            position += 1
+                            template.arguments[str(position)] = (arg_start, arg_end)
+                        else:
+                            template.arguments[text[arg_start:equals].strip()] = (equals + 1, arg_end)
+                result.append(template)
+        index = text.find("{{", index + 2)
+    return result
+
+
+def apply_patches(text: str, patches: Iterable[Patch]) -> str:
+    """
+    Replace pieces of a text in one pass
+    :param text: The original text
+    :param patches: Pieces to replace; they must not overlap
+    :return: The patched text
+    """
+    result = []
+    prev = 0
+    for start, end, replacement in sorted(patches, key=lambda p: (p[0], p[1])):
+        if start < prev:
+            raise ValueError("Patch at {} overlaps the previous one ending at {}".format(start, prev))
+        result.append(text[prev:start])
+        result.append(replacement)
+        prev = end
+    result.append(text[prev:])
+    return "".join(result)
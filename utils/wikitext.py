@@ -1,4 +1,10 @@
-from wikitextparser import WikiText, Template
+import re
+from typing import Optional, Union
+
+import wikitextparser as wtp
+from wikitextparser import WikiText, Template, Argument
+
+from utils.string_utils import normalise_title
 
 
 def title_equal(a: str, b: str) -> bool:
@@ -6,10 +12,117 @@ def title_equal(a: str, b: str) -> bool:
         return True
     if (a is None) ^ (b is None):
         return False
-    return a.strip().replace("_", " ").upper() == b.strip().replace("_", " ").upper()
+    return normalise_title(a) == normalise_title(b)
+
+
+numbered_name_pattern = re.compile(r"(.*?)([1-9][0-9]*)")
+
+
+class ArgumentIndex:
+    """
+    The arguments of a template by stripped name, built in one pass over the arguments.
+    Like Template.get_arg, the last of several arguments with the same name wins.
+    """
+
+    def __init__(self, template: Template):
+        self.arguments: dict[str, Argument] = {}
+        for arg in template.arguments:
+            self.arguments[arg.name.strip()] = arg
+        # prefix -> number -> argument, for names such as lb-text1
+        self.families: dict[str, dict[int, Argument]] = {}
+        for name, arg in self.arguments.items():
+            match = numbered_name_pattern.fullmatch(name)
+            if match is not None:
+                self.families.setdefault(match.group(1), {})[int(match.group(2))] = arg
+
+    def get(self, name: str) -> Optional[Argument]:
+        return self.arguments.get(name.strip())
+
+    def __contains__(self, name: str) -> bool:
+        return name.strip() in self.arguments
+
+    def value(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        arg = self.get(name)
+        return default if arg is None else arg.value
+
+    def numbered(self, *prefixes: str) -> list[tuple[int, list[Optional[Argument]]]]:
+        """
+        Find numbered families of arguments, such as lb-text1, rb-text1, lb-text2, ...
+        :param prefixes: Names of the arguments without their numbers
+        :return: For every number that any of the prefixes has, in increasing order, the number and
+        the argument with each prefix and that number, or None where there is none.
+        """
+        families = [self.families.get(prefix, {}) for prefix in prefixes]
+        numbers = sorted(set().union(*families))
+        return [(n, [family.get(n) for family in families]) for n in numbers]
+
+
+class ParsedPage:
+    """
+    Wikitext that is parsed once, with all of its templates, nested ones included,
+    indexed by normalised name
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.wikitext: WikiText = wtp.parse(text)
+        self.index: Optional[dict[str, list[Template]]] = None
+
+    def build_index(self) -> dict[str, list[Template]]:
+        if self.index is None:
+            self.index = {}
+            # after a template is replaced, wikitextparser can list it twice
+            spans = set()
+            for t in self.wikitext.templates:
+                if t.span in spans:
+                    continue
+                spans.add(t.span)
+                self.index.setdefault(normalise_title(t.name), []).append(t)
+        return self.index
+
+    def templates(self, name: str) -> list[Template]:
+        """
+        :param name: Name of a template
+        :return: All templates with that name, in the order they appear
+        """
+        return self.build_index().get(normalise_title(name), [])
+
+    def templates_in(self, container: Template, name: str) -> list[Template]:
+        """
+        :param container: A template of this page
+        :param name: Name of a template
+        :return: All templates with that name inside container
+        """
+        start, end = container.span
+        return [t for t in self.templates(name)
+                if start <= t.span[0] and t.span[1] <= end and t.span != container.span]
+
+    def invalidate(self):
+        """
+        Forget the index after templates were replaced, so that the new ones are found
+        :return: None
+        """
+        self.index = None
+
+    def discard_changes(self):
+        """
+        Parse the original text again, undoing every template replaced since
+        :return: None
+        """
+        self.wikitext = wtp.parse(self.text)
+        self.index = None
+
+    def __str__(self):
+        return str(self.wikitext)
+
+
+def as_parsed_page(text: Union[str, ParsedPage]) -> ParsedPage:
+    return text if isinstance(text, ParsedPage) else ParsedPage(text)
 
 
-def get_template_by_name(parsed: WikiText, target: str) -> list[Template]:
+def get_template_by_name(parsed: Union[WikiText, ParsedPage], target: str) -> list[Template]:
+    if isinstance(parsed, ParsedPage):
+        return parsed.templates(target)
     result = []
 
     for t in parsed.templates:
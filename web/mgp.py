@@ -1,4 +1,5 @@
 import asyncio
+import bisect
 import json
 import re
 import urllib.parse
@@ -18,11 +19,13 @@ from config.config import replacement_redo_limit
 from utils.japanese_utils import get_invalid_furigana
 from models.conversion_log import ConversionLog, ConversionList
 from models.lyrics import Word, Type
-from utils.string_utils import find_in_string
+from utils.string_utils import find_in_string, count_symbol_not_in_bracket
 from utils.caching import load_object
 from utils.input_utils import prompt_choices
-from utils.japanese_char import is_kanji, get_pronunciations
+from utils.japanese_char import is_kanji, get_pronunciations, find_class_spans, KANJI
+from utils.aho_corasick import AhoCorasick
 from utils.logger import get_logger
+from utils.wikitext import ParsedPage
 
 
 @dataclass
@@ -34,6 +37,26 @@ class MGPPage:
     def __init__(self, title: str, site=pywikibot.Site()):
         self.pwb_page = Page(site, title)
         self.wikitext = self.pwb_page.text
+        self.parsed_page: Optional[ParsedPage] = None
+        self.parsed_text: Optional[str] = None
+
+    @property
+    def parsed(self) -> ParsedPage:
+        """
+        The wikitext of the page parsed once and shared by everything that looks at the page.
+        It is parsed again once wikitext is replaced or the changes made to it are discarded.
+        """
+        if self.parsed_page is None or self.parsed_text is not self.wikitext:
+            self.parsed_page = ParsedPage(self.wikitext)
+            self.parsed_text = self.wikitext
+        return self.parsed_page
+
+    def discard_changes(self):
+        """
+        Forget the parse after a converter changed it in place without its edit being saved
+        :return: None
+        """
+        self.parsed_page = None
 
     @property
     def id(self) -> str:
@@ -158,54 +181,163 @@ def filter_invalid_furigana(words: list[Word], conversions: ConversionList, log:
     return words
 
 
-def replace(jap: str, words: list[Word], logs: ConversionLog) -> Optional[str]:
-    words_original = list(words)
-    words = list(words_original)
-    prev = 0
-    result = []
-    index = 0
-    bracket = 0
-    redo = 0
-    while index < len(jap):
-        ch = jap[index]
-        if index > 0 and jap[index] == jap[index - 1]:
-            if jap[index] == '{':
-                bracket += 1
-            elif jap[index] == '}':
-                bracket -= 1
-        if not is_kanji(ch) or bracket > 0 or ch in logs.ignored_kanji:
-            index += 1
+# a placed word: where it starts in the lyrics and its index in the list of words
+Placement = tuple[int, int]
+
+
+def place_words(jap: str, words: list[Word], logs: ConversionLog) -> Optional[list[Placement]]:
+    """
+    Decide where each word goes. Every kanji outside templates that is not in logs.ignored_kanji must start
+    a word, and of the words whose surface occurs there, the next one in the expected order is taken.
+    When no later word fits, the words are started over, at most replacement_redo_limit times.
+    All occurrences of all surfaces are found with one pass of an Aho-Corasick automaton.
+    :param jap: Japanese lyrics
+    :param words: Kanji words in the order they are expected in jap
+    :param logs: Words that are not placed are recorded in logs.unplaced_words
+    :return: The placements in the order of the lyrics, or None if a kanji cannot be covered.
+    """
+    surface_ids: dict[str, int] = {}
+    # indices of the words with each surface, in increasing order
+    word_indices: list[list[int]] = []
+    for index, word in enumerate(words):
+        if len(word.surface) == 0:
             continue
-        result.append(jap[prev:index])
-        while True:
-            if len(words) == 0:
+        if word.surface not in surface_ids:
+            surface_ids[word.surface] = len(word_indices)
+            word_indices.append([])
+        word_indices[surface_ids[word.surface]].append(index)
+    occurrences: dict[int, list[int]] = {}
+    if len(surface_ids) > 0:
+        for start, surface_id in AhoCorasick(surface_ids).find_all(jap):
+            occurrences.setdefault(start, []).append(surface_id)
+    depth_map = string_utils.get_depth_map(jap)
+    ignored_kanji = set(logs.ignored_kanji)
+    placements: list[Placement] = []
+    cursor = 0
+    redo = 0
+    index = 0
+    for span_start, span_end in find_class_spans(jap, KANJI):
+        for position in range(max(span_start, index), span_end):
+            if position < index or jap[position] in ignored_kanji or depth_map.depth_at(position) > 0:
+                continue
+            candidates = occurrences.get(position)
+            if candidates is None:
+                return None
+            nexts = [indices[k] for indices in (word_indices[c] for c in candidates)
+                     for k in [bisect.bisect_left(indices, cursor)] if k < len(indices)]
+            if len(nexts) == 0:
                 if redo > replacement_redo_limit:
                     return None
                 redo += 1
-                words = list(words_original)
-            word = words.pop(0)
-            surface = word.surface
-            if jap[index:index + len(surface)] == surface:
-                index += len(surface)
-                prev = index
-                logs.word_used(word)
-                if string_utils.is_empty(word.hiragana):
-                    result.append(word.surface)
-                else:
-                    result.append("{{{{photrans|{}|{}}}}}".format(word.surface, word.hiragana))
-                break
+                nexts = [word_indices[c][0] for c in candidates]
+            chosen = min(nexts)
+            placements.append((position, chosen))
+            cursor = chosen + 1
+            index = position + len(words[chosen].surface)
+    placed = set(chosen for _, chosen in placements)
+    unplaced = [w for i, w in enumerate(words) if i not in placed]
+    if len(unplaced) > 0:
+        get_logger().debug("Words not placed in the lyrics: {}".format(unplaced))
+        logs.unplaced_words.extend(unplaced)
+    return placements
+
+
+def render_words(jap: str, placed: list[tuple[int, Word]], logs: ConversionLog) -> str:
+    """
+    Insert photrans templates for placed words
+    :param jap: Japanese lyrics
+    :param placed: Start of each word in jap and the word, in the order of the lyrics
+    :param logs: Every word is recorded with logs.word_used
+    :return: The lyrics with photrans templates
+    """
+    result = []
+    prev = 0
+    for position, word in placed:
+        result.append(jap[prev:position])
+        logs.word_used(word)
+        if string_utils.is_empty(word.hiragana):
+            result.append(word.surface)
+        else:
+            result.append("{{{{photrans|{}|{}}}}}".format(word.surface, word.hiragana))
+        prev = position + len(word.surface)
     result.append(jap[prev:])
     return "".join(result)
 
 
+def replace(jap: str, words: list[Word], logs: ConversionLog) -> Optional[str]:
+    placements = place_words(jap, words, logs)
+    if placements is None:
+        return None
+    return render_words(jap, [(position, words[i]) for position, i in placements], logs)
+
+
+def undo_removed_conversions(words: list[Word], logs: ConversionLog) -> list[Word]:
+    for before, after in logs.removed_conversions:
+        words = [before if w == after else w for w in words]
+    return words
+
+
 def replace_lyrics_jap(jap: str, words: list[Word], logs: ConversionLog) -> Optional[str]:
     words = [w for w in words if w.type == Type.KANJI]
-    res = replace(jap, words, logs)
-    if res is None:
+    placements = place_words(jap, words, logs)
+    if placements is None:
         return None
-    words = filter_invalid_furigana(logs.all_words, logs.word_conversions, logs)
+    placed = [words[i] for _, i in placements]
+    logs.all_words.extend(placed)
+    logs.final_words = list(filter_invalid_furigana(logs.all_words, logs.word_conversions, logs))
+    # readings that were taken back keep their places, so the words are not placed again
+    placed = undo_removed_conversions(placed, logs)
+    logs.used_conversions = []
+    return render_words(jap, [(position, w) for (position, _), w in zip(placements, placed)], logs)
+
+
+def replace_lyrics_lines(jap: str, line_words: list[Optional[list[Word]]], logs: ConversionLog) -> str:
+    """
+    Replace the kanji of every line with the words converted from its counterpart.
+    Lines without a counterpart or whose counterpart does not fit are left as they are and recorded
+    in logs.unaligned_lines.
+    :param jap: Japanese lyrics
+    :param line_words: A list parallel with the lines of jap holding the words of the counterpart of each line,
+    or None if the line has no counterpart.
+    :param logs: Records of the conversion
+    :return: The lyrics with photrans templates
+    """
+    lines = jap.split("\n")
+    # lines that share a counterpart keep sharing its list of words
+    kanji_words: dict[int, list[Word]] = {}
+    for words in line_words:
+        if words is not None and id(words) not in kanji_words:
+            kanji_words[id(words)] = [w for w in words if w.type == Type.KANJI]
+    line_words = [None if words is None else kanji_words[id(words)] for words in line_words]
+    line_placements: list[Optional[list[Placement]]] = []
+    for index, (line, words) in enumerate(zip(lines, line_words)):
+        placements = None
+        if words is not None and len(words) > 0:
+            placements = place_words(line, words, logs)
+        if placements is None:
+            if words is not None and count_symbol_not_in_bracket(line, is_kanji) > 0 and \
+                    (index, index + 1) not in logs.unaligned_lines:
+                get_logger().warning("Words {} do not fit line {}".format(words, line))
+                logs.unaligned_lines.append((index, index + 1))
+        else:
+            logs.all_words.extend(words[i] for _, i in placements)
+        line_placements.append(placements)
+    filter_invalid_furigana(logs.all_words, logs.word_conversions, logs)
+    logs.final_words = []
     logs.used_conversions = []
-    return replace(jap, words, logs)
+    # lines such as a repeated chorus share the words of one counterpart, which are recorded once
+    restored: dict[int, list[Word]] = {}
+    result = []
+    for line, words, placements in zip(lines, line_words, line_placements):
+        if placements is None:
+            result.append(line)
+            continue
+        if id(words) not in restored:
+            restored[id(words)] = undo_removed_conversions(words, logs)
+            logs.final_words.extend(restored[id(words)][i] for _, i in placements)
+        words = restored[id(words)]
+        result.append(render_words(line, [(position, words[i]) for position, i in placements], logs))
+    return "\n".join(result)
 
 
 edit_lock = asyncio.Lock()
@@ -216,6 +348,7 @@ def save_edit(text: str, page: MGPPage, summary: str, confirm: bool, minor: bool
     get_logger().info(
         "Pushing changes of " + str(page) +
         " url https://zh.moegirl.org.cn/" + urllib.parse.quote(page.title))
+    previous = page.pwb_page.text
     page.pwb_page.text = text
     get_logger().info(summary)
     if not confirm or prompt_choices("Save?", ["Yes", "No"]) == 1:
@@ -223,11 +356,15 @@ def save_edit(text: str, page: MGPPage, summary: str, confirm: bool, minor: bool
             try:
                 page.pwb_page.save(summary=summary,
                                    watch=watch, minor=minor, asynchronous=False, botflag=True, tags=tags)
+                # the page is parsed again from the saved text when it is next looked at
+                page.wikitext = text
                 return True
             except Exception as e:
                 print(e)
                 sleep(5)
     get_logger().info("Rejected changes proposed to " + page.title)
+    page.pwb_page.text = previous
+    page.discard_changes()
     return False
 
 
@@ -1,11 +1,12 @@
 import json
-from typing import Optional
+from typing import Optional, Iterator
 from urllib.parse import quote
 
 import requests
 from bs4 import BeautifulSoup
 
-from utils.japanese_utils import lyrics_match
+from utils.japanese_utils import signatures_match
+from utils.lyrics_similarity import get_signature, rank_candidates, kanji_mismatch
 from models.conversion_log import ConversionLog
 from utils.logger import get_logger
 from utils.string_utils import is_empty
@@ -81,6 +82,19 @@ def retrieve_lyrics_from_page(url: str) -> Optional[tuple[str, str]]:
     return "".join(japanese_list), "".join(romaji_list)
 
 
+def candidate_urls(names: list[str], producer: str = None) -> Iterator[str]:
+    """
+    Search for each name only once the pages found for the names before it have been looked at
+    :return: Urls of the search results in order, without duplicates
+    """
+    seen = set()
+    for name in names:
+        for url in search(name, producer) or []:
+            if url not in seen:
+                seen.add(url)
+                yield url
+
+
 def get_romaji(names: list[str], lyrics_jap: str, logs: ConversionLog, producer: str = None) -> Optional[tuple[list[str], list[str]]]:
     """
     Search Vocaloid Lyrics Wiki for a song.
@@ -91,25 +105,30 @@ def get_romaji(names: list[str], lyrics_jap: str, logs: ConversionLog, producer:
     :return: If found, a tuple of (1) a list of Japanese lyrics line by line (2) a list of romaji line by line
     Otherwise, return None
     """
-    # find all urls given by the search result
-    urls = set()
-    for name in names:
-        res = search(name, producer)
-        for r in res:
-            urls.add(r)
-    # for each url, try to retrieve the lyrics from the page
-    for url in urls:
+    expected = get_signature(lyrics_jap)
+    candidates = []
+    signatures = []
+    # retrieve pages in search order until one has every kanji of the expected lyrics
+    for url in candidate_urls(names, producer):
         res = retrieve_lyrics_from_page(url)
         if res is None:
             continue
-        jap, romaji = res
-        # if the japanese lyrics matches the expected japanese lyrics, the correct song is
-        # found, so return
-        if lyrics_match(lyrics_jap, jap, logs):
-            jap_list = jap.split("\n")
-            romaji_list = romaji.split("\n")
-            # FIXME: whether spaces and other special characters are kept should be
-            #   decided later
-            # filter out special characters in romaji
-            return jap_list, ["".join([c for c in line if c.isalnum()]) for line in romaji_list]
+        candidates.append(res)
+        signatures.append(get_signature(res[0]))
+        if len(kanji_mismatch(expected, signatures[-1])) == 0:
+            break
+    if len(candidates) == 0:
+        return None
+    # if none has all of them, the one closest to the expected lyrics is the only one that could still match
+    index, coverage = rank_candidates(expected, signatures)[0]
+    get_logger().debug("Best of {} candidates covers {:.1%} of the kanji".format(len(candidates), coverage))
+    # only the best candidate can be the correct song
+    jap, romaji = candidates[index]
+    if signatures_match(expected, signatures[index], logs):
+        jap_list = jap.split("\n")
+        romaji_list = romaji.split("\n")
+        # FIXME: whether spaces and other special characters are kept should be
+        #   decided later
+        # filter out special characters in romaji
+        return jap_list, ["".join([c for c in line if c.isalnum()]) for line in romaji_list]
     return None
@@ -3,11 +3,10 @@ import logging
 from dataclasses import dataclass
 from typing import Optional
 
-import pykakasi
 import requests
 
 from utils.caching import get_cache, save_cache
-from utils.japanese_char import is_kanji, is_japanese, is_kana
+from utils.japanese_char import is_kanji, is_japanese, is_kana, kakasi_to_hiragana
 from models.lyrics import Word, Type
 from utils.logger import get_logger
 
@@ -38,7 +37,6 @@ def get_furigana(text: str, page_id: str) -> Optional[list[Word]]:
     response = json.loads(response)
     if 'result' not in response:
         get_logger().warning("No response from Yahoo. Using pykakasi as fallback.")
-        kks = pykakasi.Kakasi()
         sections = []
         cur = ""
         prev_type = None
@@ -53,7 +51,7 @@ def get_furigana(text: str, page_id: str) -> Optional[list[Word]]:
                 cur_type = None
             if cur_type != prev_type or cur_type == Type.KANJI:
                 if prev_type is not None:
-                    hira = "".join([part['hira'] for part in kks.convert(cur)])
+                    hira = kakasi_to_hiragana(cur)
                     sections.append(Word(surface=cur, hiragana=hira, type=prev_type))
                 cur = ""
                 prev_type = cur_type
@@ -75,8 +73,7 @@ def get_furigana(text: str, page_id: str) -> Optional[list[Word]]:
                 if 'furigana' in word:
                     furigana = word['furigana']
                 else:
-                    kks = pykakasi.Kakasi()
-                    furigana = "".join([word['hira'] for word in kks.convert(surface)])
+                    furigana = kakasi_to_hiragana(surface)
                     get_logger().warning("Yahoo does not provide furigana for " + surface + ". " +
                                     "Using " + furigana + " from pykakasi as fallback.")
                 result.append(Word(surface=surface, type=Type.KANJI,